@@ -6,7 +6,7 @@ from sqlalchemy import pool
 from alembic import context
 
 from app.config import settings
-from app.models import Base
+from app.models import VOTE_PARTITIONS, Base
 
 # TODO Fix alembic history because of wrong migration files
 
@@ -29,6 +29,17 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+# Created by DDL instead of being declared on the models: by app/search.py as SQLite shares the
+# models, and the partitions of votes by app/models.py. Autogenerate would otherwise drop them
+UNDECLARED = {("column", "search_vector"), ("index", "ix_posts_search_vector")} | {
+    ("table", f"votes_p{remainder}") for remainder in range(VOTE_PARTITIONS)
+}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and compare_to is None and (type_, name) in UNDECLARED)
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -51,6 +62,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -73,7 +85,9 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection, target_metadata=target_metadata, include_object=include_object
+        )
 
         with context.begin_transaction():
             context.run_migrations()
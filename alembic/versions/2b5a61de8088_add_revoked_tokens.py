@@ -0,0 +1,43 @@
+"""add revoked tokens
+
+Revision ID: 2b5a61de8088
+Revises: 93aced77ecf0
+Create Date: 2026-10-18 17:02:51.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2b5a61de8088"
+down_revision = "93aced77ecf0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "revoked_tokens",
+        sa.Column("jti", sa.String(), nullable=False),
+        sa.Column(
+            "revoked_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("expires_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("jti"),
+    )
+    op.create_index(
+        "ix_revoked_tokens_revoked_at", "revoked_tokens", ["revoked_at"]
+    )
+    op.create_index(
+        "ix_revoked_tokens_expires_at", "revoked_tokens", ["expires_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_revoked_tokens_expires_at", table_name="revoked_tokens")
+    op.drop_index("ix_revoked_tokens_revoked_at", table_name="revoked_tokens")
+    op.drop_table("revoked_tokens")
@@ -0,0 +1,33 @@
+"""add posts created_at id index
+
+Revision ID: 3f0c9d21b7e4
+Revises: 8b81f04a0644
+Create Date: 2026-10-18 10:03:17.552901
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "3f0c9d21b7e4"
+down_revision = "8b81f04a0644"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction, but doesn't block writes on posts
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_posts_created_at_id",
+            "posts",
+            ["created_at", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_posts_created_at_id", table_name="posts", postgresql_concurrently=True
+        )
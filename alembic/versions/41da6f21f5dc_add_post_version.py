@@ -0,0 +1,28 @@
+"""add post version
+
+Revision ID: 41da6f21f5dc
+Revises: 2b5a61de8088
+Create Date: 2026-10-18 18:21:37.550812
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "41da6f21f5dc"
+down_revision = "2b5a61de8088"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A constant default doesn't rewrite the table
+    op.add_column(
+        "posts",
+        sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("posts", "version")
@@ -0,0 +1,37 @@
+"""add user_id indexes
+
+Revision ID: 7e68f9452f56
+Revises: c41a7e5d92f8
+Create Date: 2026-10-18 14:12:41.207395
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "7e68f9452f56"
+down_revision = "c41a7e5d92f8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Deleting a user cascades to its posts and votes, which scan both tables without these.
+    # posts.created_at is already covered by ix_posts_created_at_id
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_posts_user_id", "posts", ["user_id"], postgresql_concurrently=True
+        )
+        op.create_index(
+            "ix_votes_user_id", "votes", ["user_id"], postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_votes_user_id", table_name="votes", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_posts_user_id", table_name="posts", postgresql_concurrently=True
+        )
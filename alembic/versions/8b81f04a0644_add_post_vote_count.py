@@ -0,0 +1,32 @@
+"""add post vote count
+
+Revision ID: 8b81f04a0644
+Revises: 8e5ad6f1a5eb
+Create Date: 2026-10-18 09:12:41.204113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8b81f04a0644"
+down_revision = "8e5ad6f1a5eb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "posts",
+        sa.Column("vote_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    # Backfill from the votes table, `python -m app.commands reconcile-votes` fixes any later drift
+    op.execute(
+        "UPDATE posts SET vote_count = "
+        "(SELECT count(*) FROM votes WHERE votes.post_id = posts.id)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("posts", "vote_count")
@@ -0,0 +1,54 @@
+"""add post rankings
+
+Revision ID: 93aced77ecf0
+Revises: 7e68f9452f56
+Create Date: 2026-10-18 15:40:08.613920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = "93aced77ecf0"
+down_revision = "7e68f9452f56"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "post_rankings",
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.Column("votes", sa.Integer(), nullable=False),
+        sa.Column("hot", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["post_id"], ["posts.id"], ondelete="CASCADE", onupdate="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("post_id"),
+    )
+    # Backfilled before indexing, which is faster than maintaining the indexes row by row.
+    # The hot score decays like app/ranking.py's, with the configured HOT_DECAY_SECONDS. Run
+    # `python -m app.commands refresh-rankings` after changing it
+    op.execute(
+        sa.text(
+            "INSERT INTO post_rankings (post_id, votes, hot) "
+            "SELECT id, vote_count, "
+            "log(vote_count + 1) + CAST(extract(epoch FROM created_at) AS FLOAT) / :hot_decay_seconds "
+            "FROM posts"
+        ).bindparams(hot_decay_seconds=settings.hot_decay_seconds)
+    )
+    op.create_index(
+        "ix_post_rankings_hot_post_id", "post_rankings", ["hot", "post_id"]
+    )
+    op.create_index(
+        "ix_post_rankings_votes_post_id", "post_rankings", ["votes", "post_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_post_rankings_votes_post_id", table_name="post_rankings")
+    op.drop_index("ix_post_rankings_hot_post_id", table_name="post_rankings")
+    op.drop_table("post_rankings")
@@ -0,0 +1,83 @@
+"""partition votes and soft delete posts
+
+Revision ID: 9fe5143483bd
+Revises: 41da6f21f5dc
+Create Date: 2026-10-18 19:40:12.318064
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9fe5143483bd"
+down_revision = "41da6f21f5dc"
+branch_labels = None
+depends_on = None
+
+VOTE_PARTITIONS = 8
+
+
+def create_votes_table(**kwargs) -> None:
+    op.create_table(
+        "votes",
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["post_id"], ["posts.id"], onupdate="CASCADE", ondelete="CASCADE"
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["users.id"], onupdate="CASCADE", ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("post_id", "user_id"),
+        **kwargs,
+    )
+
+
+def replace_votes_table(**kwargs) -> None:
+    """Create votes anew, with kwargs, and move the rows of the current one to it"""
+    # The index names are shared by the whole schema, the old ones have to make room
+    op.rename_table("votes", "votes_old")
+    op.execute("ALTER INDEX votes_pkey RENAME TO votes_old_pkey")
+    op.drop_index("ix_votes_user_id", table_name="votes_old")
+    create_votes_table(**kwargs)
+    if kwargs:
+        for remainder in range(VOTE_PARTITIONS):
+            op.execute(
+                f"CREATE TABLE votes_p{remainder} PARTITION OF votes "
+                f"FOR VALUES WITH (MODULUS {VOTE_PARTITIONS}, REMAINDER {remainder})"
+            )
+    op.execute(
+        "INSERT INTO votes (post_id, user_id, created_at) "
+        "SELECT post_id, user_id, created_at FROM votes_old"
+    )
+    op.drop_table("votes_old")
+    op.create_index("ix_votes_user_id", "votes", ["user_id"])
+
+
+def upgrade() -> None:
+    op.add_column(
+        "posts", sa.Column("deleted_at", sa.TIMESTAMP(timezone=True), nullable=True)
+    )
+    op.create_index(
+        "ix_posts_deleted_at",
+        "posts",
+        ["deleted_at"],
+        postgresql_where=sa.text("deleted_at IS NOT NULL"),
+    )
+    # Rewrites the votes, the table is locked until the migration commits
+    replace_votes_table(postgresql_partition_by="HASH (post_id)")
+
+
+def downgrade() -> None:
+    replace_votes_table()
+    # Without the column, the posts waiting to be purged would come back
+    op.execute("DELETE FROM posts WHERE deleted_at IS NOT NULL")
+    op.drop_index("ix_posts_deleted_at", table_name="posts")
+    op.drop_column("posts", "deleted_at")
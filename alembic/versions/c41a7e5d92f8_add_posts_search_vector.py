@@ -0,0 +1,47 @@
+"""add posts search vector
+
+Revision ID: c41a7e5d92f8
+Revises: 3f0c9d21b7e4
+Create Date: 2026-10-18 11:26:50.318774
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "c41a7e5d92f8"
+down_revision = "3f0c9d21b7e4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Adding a stored generated column rewrites posts, run it in a quiet window on big tables
+    op.add_column(
+        "posts",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "to_tsvector('english', title || ' ' || content)", persisted=True
+            ),
+        ),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_posts_search_vector",
+            "posts",
+            ["search_vector"],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_posts_search_vector", table_name="posts", postgresql_concurrently=True
+        )
+    op.drop_column("posts", "search_vector")
@@ -0,0 +1,84 @@
+"""Bulk creation of posts, for POST /posts/bulk
+
+The posts are validated as they are read: line by line as the body arrives for NDJSON, item by item
+for a JSON array, which has to be read whole first. Every settings.bulk_chunk_size posts, the chunk
+is loaded with COPY, its ids drawn from the sequence beforehand so that they can be returned.
+"""
+from typing import AsyncIterator, List
+
+import orjson
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .config import settings
+from .database import copy_rows
+
+
+COPY_COLUMNS = ["id", "title", "content", "published", "user_id"]
+
+
+def _invalid_json() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON")
+
+
+async def _ndjson_items(request: Request) -> AsyncIterator:
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield orjson.loads(line)
+    if pending.strip():
+        yield orjson.loads(pending)
+
+
+async def _json_array_items(request: Request) -> AsyncIterator:
+    items = orjson.loads(await request.body())
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Expected an array of posts"
+        )
+    for item in items:
+        yield item
+
+
+async def read_posts(request: Request) -> AsyncIterator[schemas.PostCreate]:
+    """The posts of the body, NDJSON if its Content-Type says so, else a JSON array"""
+    ndjson = request.headers.get("content-type", "").split(";")[0].strip() == "application/x-ndjson"
+    items = _ndjson_items(request) if ndjson else _json_array_items(request)
+    index = 0
+    try:
+        async for item in items:
+            if index == settings.bulk_max_posts:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"At most {settings.bulk_max_posts} posts per request",
+                )
+            try:
+                yield schemas.PostCreate.parse_obj(item)
+            except ValidationError as e:
+                # Located like FastAPI's own validation errors
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=[{**error, "loc": ("body", index, *error["loc"])} for error in e.errors()],
+                )
+            index += 1
+    except orjson.JSONDecodeError:
+        raise _invalid_json()
+
+
+async def copy_posts(db: AsyncSession, user_id: int, posts: List[schemas.PostCreate]) -> List[int]:
+    """COPY the posts of user_id, in the transaction of db, and return their ids in order"""
+    result = await db.execute(
+        select(func.nextval(func.pg_get_serial_sequence("posts", "id"))).select_from(
+            func.generate_series(1, len(posts))
+        )
+    )
+    ids = sorted(result.scalars())
+    rows = [(id, post.title, post.content, post.published, user_id) for id, post in zip(ids, posts)]
+    await copy_rows(db, models.Post.__tablename__, COPY_COLUMNS, rows)
+    return ids
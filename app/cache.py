@@ -0,0 +1,293 @@
+"""In-process caches, optionally backed by a cache shared by all the workers
+
+Each worker keeps a bounded TTLCache. When Settings.cache_backend names a CacheBackend
+("package.module:Class"), the ModelCaches and ResponseCaches also go through it, so a
+value computed by one worker is reused by the others.
+"""
+import hashlib
+import importlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, Tuple, Type, TypeVar
+from urllib.parse import urlencode
+
+from fastapi import Request, Response, status
+from pydantic import BaseModel
+
+from . import metrics, serialization
+from .config import settings
+
+
+CACHE_HITS = metrics.Counter("cache_hits_total", "Lookups answered by the cache", ["cache"])
+CACHE_MISSES = metrics.Counter("cache_misses_total", "Lookups the cache couldn't answer", ["cache"])
+CACHE_EVICTIONS = metrics.Counter("cache_evictions_total", "Entries dropped to make room", ["cache"])
+CACHE_SIZE = metrics.Gauge("cache_size", "Entries currently cached", ["cache"])
+CACHE_HIT_RATIO = metrics.Gauge("cache_hit_ratio", "Share of the lookups answered by the cache", ["cache"])
+
+_caches: Dict[str, "TTLCache"] = {}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread safe LRU mapping of at most maxsize entries, which expire ttl seconds after being set.
+
+    A maxsize of 0 disables the cache, a ttl of None keeps the entries until they're evicted.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float]):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            expires_at, value = self._data.get(key, (None, _MISSING))
+            if value is not _MISSING and expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                CACHE_MISSES.inc(cache=self.name)
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            CACHE_HITS.inc(cache=self.name)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVICTIONS.inc(cache=self.name)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@metrics.on_collect
+def _collect_cache_stats():
+    for name, cache in _caches.items():
+        CACHE_SIZE.set(len(cache), cache=name)
+    for labels in CACHE_HITS.labelsets() + CACHE_MISSES.labelsets():
+        hits, misses = CACHE_HITS.value(**labels), CACHE_MISSES.value(**labels)
+        CACHE_HIT_RATIO.set(hits / (hits + misses), **labels)
+
+
+class CacheBackend:
+    """Cache shared by the workers, such as Redis or memcached. Values are bytes"""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def compare_and_set(self, key: str, expected: Optional[bytes], value: bytes, ttl: float) -> bool:
+        """Atomically set key if it still holds expected (None for missing), return whether it did.
+
+        Such as a Lua script on Redis, or gets and cas on memcached.
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Stand-in for a shared backend, only shared inside its process"""
+
+    def __init__(self, maxsize: int = 100_000):
+        self._cache = TTLCache("shared", maxsize, ttl=None)
+        self._cas_lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, key: str):
+        self._cache.delete(key)
+
+    async def compare_and_set(self, key: str, expected: Optional[bytes], value: bytes, ttl: float) -> bool:
+        with self._cas_lock:
+            if self._cache.get(key) != expected:
+                return False
+            self._cache.set(key, value, ttl)
+        return True
+
+
+def load_backend(path: str) -> Optional[CacheBackend]:
+    if not path:
+        return None
+    module_name, _, class_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+shared_backend = load_backend(settings.cache_backend)
+
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class ModelCache(Generic[Model]):
+    """Pydantic models cached by this worker first, then by the shared backend if there is one.
+
+    Invalidating only reaches the shared backend and this worker, the other workers may serve
+    their local copy until its ttl runs out, so keep it short.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: Type[Model],
+        maxsize: int,
+        ttl: float,
+        backend: Optional[CacheBackend] = None,
+    ):
+        self.name = name
+        self.model = model
+        self.ttl = ttl
+        self.local = TTLCache(name, maxsize, ttl)
+        self.backend = backend if maxsize > 0 else None
+
+    def _shared_key(self, key: Hashable) -> str:
+        return f"{self.name}:{key}"
+
+    async def get(self, key: Hashable) -> Optional[Model]:
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            raw = await self.backend.get(self._shared_key(key))
+            if raw is not None:
+                value = self.model.parse_raw(raw)
+                self.local.set(key, value)
+        return value
+
+    async def set(self, key: Hashable, value: Model):
+        self.local.set(key, value)
+        if self.backend is not None:
+            await self.backend.set(self._shared_key(key), value.json().encode(), self.ttl)
+
+    async def invalidate(self, key: Hashable):
+        self.local.delete(key)
+        if self.backend is not None:
+            await self.backend.delete(self._shared_key(key))
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    """Serialized JSON responses of read routes, keyed on their path and query parameters.
+
+    The keys include a version which invalidate() replaces, dropping every cached response at
+    once. A request takes the version before reading the database, so a response computed
+    from data older than a concurrent write is stored under an outdated key and never served.
+    Without a shared backend the version is per worker, the other workers keep serving their
+    responses until the ttl runs out.
+
+    Only the responses read from the primary are cached, see store_body. Responses carry an ETag,
+    requests sending it back in If-None-Match get a 304.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, backend: Optional[CacheBackend] = None):
+        self.name = name
+        self.ttl = ttl
+        self.local = TTLCache(name, maxsize, ttl)
+        self.backend = backend if maxsize > 0 else None
+        self._version = uuid.uuid4().hex
+
+    async def _current_version(self) -> str:
+        if self.backend is None:
+            return self._version
+        version = await self.backend.get(f"{self.name}:version")
+        return version.decode() if version else ""
+
+    async def invalidate(self):
+        self._version = uuid.uuid4().hex
+        self.local.clear()
+        if self.backend is not None:
+            # Outlives every entry, so a version reset by expiry can't resurrect old ones
+            await self.backend.set(f"{self.name}:version", self._version.encode(), max(self.ttl * 100, 86400))
+
+    async def lookup(self, request: Request) -> Tuple[str, Optional[Response]]:
+        """Return the cache key of the request, and its response if it is cached"""
+        query = urlencode(sorted(request.query_params.multi_items()))
+        key = f"{self.name}:{await self._current_version()}:{request.url.path}?{query}"
+        if getattr(request.state, "skip_cache", False):
+            # Set by app.replicas.get_read_db for the users who must see their writes, the cached
+            # responses may have been read from a replica which hasn't replayed them
+            return key, None
+        if self.backend is None:
+            cached = self.local.get(key)
+        else:
+            raw = await self.backend.get(key)
+            cached = None if raw is None else tuple(raw.split(b"\n", 1))
+            (CACHE_HITS if cached else CACHE_MISSES).inc(cache=self.name)
+        if cached is None:
+            return key, None
+        etag, body = cached
+        return key, self._respond(request, body, etag.decode())
+
+    async def store(
+        self, request: Request, key: str, response_type: Any, content: Any, etag_prefix: str = ""
+    ) -> Response:
+        """Serialize content as response_type, cache it under key and return its response"""
+        return await self.store_body(
+            request, key, serialization.dump_model(response_type, content), etag_prefix
+        )
+
+    async def store_body(self, request: Request, key: str, body: bytes, etag_prefix: str = "") -> Response:
+        """Cache the already serialized JSON body under key and return its response.
+
+        The ETag is the digest of the body, after etag_prefix which can tell the clients more about it.
+        """
+        etag = f'"{etag_prefix}{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        if getattr(request.state, "read_replica", None) is not None:
+            # Set by app.replicas.get_read_db. The replica may not have replayed a write the cache was
+            # invalidated for, its body would be served stale to everyone, its writer included
+            return self._respond(request, body, etag)
+        if self.backend is None:
+            self.local.set(key, (etag.encode(), body))
+        else:
+            await self.backend.set(key, etag.encode() + b"\n" + body, self.ttl)
+        return self._respond(request, body, etag)
+
+    def _respond(self, request: Request, body: bytes, etag: str) -> Response:
+        if _etag_matches(request, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(body, media_type="application/json", headers={"ETag": etag})
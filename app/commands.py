@@ -0,0 +1,310 @@
+"""Management commands, run them with `python -m app.commands <command>`"""
+import argparse
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Tuple
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from . import database, models
+from .ranking import refresh_all_rankings
+from .database import SessionLocal, ThreadedSession, get_db, get_engine, session_scope
+from .purge import Purger
+from .oauth2 import create_access_token, create_tokens
+from .pagination import encode_cursor
+
+
+def reconcile_votes(db: Session, batch_size: int = 1000) -> int:
+    """Recount posts.vote_count from the votes table and return how many posts had drifted.
+
+    Posts are walked by id in batches, each committed on its own, so only the rows of the
+    current batch whose counter is wrong get locked, and only for the time of one UPDATE.
+    """
+    counted_votes = (
+        select(func.count())
+        .where(models.Vote.post_id == models.Post.id)
+        .scalar_subquery()
+    )
+    fixed = 0
+    last_id = 0
+    while True:
+        batch_ids = (
+            db.query(models.Post.id)
+            .filter(models.Post.id > last_id)
+            .order_by(models.Post.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch_ids:
+            return fixed
+        batch_last_id = batch_ids[-1][0]
+        result = db.execute(
+            update(models.Post)
+            .where(
+                models.Post.id > last_id,
+                models.Post.id <= batch_last_id,
+                models.Post.vote_count != counted_votes,
+            )
+            .values(vote_count=counted_votes)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        fixed += result.rowcount
+        last_id = batch_last_id
+
+
+class QueryPlan(NamedTuple):
+    statement: str
+    execution_ms: float
+    shared_hit_blocks: int
+    shared_read_blocks: int
+    seq_scans: List[Tuple[str, int]]  # The tables read by a sequential scan and how many rows it read
+
+
+def _router_requests(db: Session) -> Tuple[models.User, List[Tuple[str, str, Dict[str, Any]]]]:
+    """Requests going through every route as the returned user, built from the posts in the database"""
+    own_post = db.query(models.Post).order_by(models.Post.id).first()
+    if own_post is None:
+        raise ValueError("The database has no posts, seed it first (python -m benchmarks.seed)")
+    user = db.get(models.User, own_post.user_id)
+    other_post = db.query(models.Post).filter(models.Post.user_id != user.id).first() or own_post
+    latest_post = db.query(models.Post).order_by(models.Post.id.desc()).first()
+    cursor_post = (
+        db.query(models.Post)
+        .order_by(models.Post.created_at.desc(), models.Post.id.desc())
+        .offset(100)
+        .first()
+    ) or own_post
+    # Tokens of their own, as logging out revokes the family of the access token
+    tokens = create_tokens(user.id)
+    return user, [
+        ("GET", "/posts/", {"params": {"limit": 10}}),
+        ("GET", "/posts/", {"params": {"limit": 10, "skip": 100}}),
+        ("GET", "/posts/", {"params": {"limit": 10, "cursor": encode_cursor(cursor_post)}}),
+        ("GET", "/posts/", {"params": {"limit": 10, "search": latest_post.title}}),
+        ("GET", "/posts/", {"params": {"limit": 10, "sort": "hot"}}),
+        ("GET", "/posts/", {"params": {"limit": 10, "sort": "top"}}),
+        ("GET", "/posts/export", {"params": {"search": latest_post.title}}),
+        ("GET", "/posts/latest", {}),
+        ("GET", f"/posts/{own_post.id}", {}),
+        ("GET", f"/users/{user.id}", {}),
+        ("POST", "/login", {"data": {"username": user.email, "password": ""}}),
+        ("POST", "/token/refresh", {"json": {"refresh_token": tokens["refresh_token"]}}),
+        ("POST", "/logout", {"headers": {"Authorization": f"Bearer {tokens['access_token']}"}}),
+        ("POST", "/users/", {"json": {"email": "explain_queries@example.com", "password": "password"}}),
+        ("POST", "/posts/", {"json": {"title": "title", "content": "content"}}),
+        ("POST", "/posts/bulk", {"json": [{"title": "title", "content": "content"}] * 2}),
+        ("PUT", f"/posts/{own_post.id}", {"json": {"title": "title", "content": "content"}}),
+        ("PATCH", f"/posts/{own_post.id}", {"json": {"title": "title"}}),
+        ("POST", "/votes/", {"json": {"post_id": other_post.id, "dir": 1}}),
+        ("POST", "/votes/", {"json": {"post_id": other_post.id, "dir": 0}}),
+        ("POST", "/votes/batch", {"json": [{"post_id": other_post.id, "dir": 1}]}),
+        ("DELETE", f"/posts/{own_post.id}", {}),
+    ]
+
+
+def capture_router_queries(connection: Connection) -> List[Tuple[str, Any]]:
+    """Replay requests through every route and return the distinct statements they executed.
+
+    Everything runs in a transaction of connection, which the caller is expected to roll back:
+    the sessions of the routers only commit subtransactions of it.
+    """
+    from fastapi.testclient import TestClient
+    from .main import app
+
+    statements: Dict[str, Any] = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.setdefault(statement, parameters)
+
+    async def get_explained_db() -> AsyncIterator[ThreadedSession]:
+        session = Session(bind=connection, autoflush=False, expire_on_commit=False)
+        try:
+            yield ThreadedSession(session)
+        finally:
+            session.close()
+
+    db = Session(bind=connection)
+    user, requests = _router_requests(db)
+    token = create_access_token({"user_id": user.id})
+    db.close()
+
+    previous_override = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = get_explained_db
+    previous_session_scope, database.session_scope = database.session_scope, asynccontextmanager(get_explained_db)
+    event.listen(connection, "before_cursor_execute", record)
+    try:
+        client = TestClient(app)
+        client.headers["Authorization"] = f"Bearer {token}"
+        for method, path, kwargs in requests:
+            client.request(method, path, **kwargs)
+    finally:
+        event.remove(connection, "before_cursor_execute", record)
+        database.session_scope = previous_session_scope
+        if previous_override is None:
+            app.dependency_overrides.pop(get_db, None)
+        else:
+            app.dependency_overrides[get_db] = previous_override
+    return list(statements.items())
+
+
+def find_seq_scans(plan: Dict[str, Any]) -> List[Tuple[str, int]]:
+    found = []
+    if plan["Node Type"] == "Seq Scan":
+        rows_per_loop = plan.get("Actual Rows", 0) + plan.get("Rows Removed by Filter", 0)
+        found.append((plan["Relation Name"], rows_per_loop * plan.get("Actual Loops", 1)))
+    for child in plan.get("Plans", []):
+        found += find_seq_scans(child)
+    return found
+
+
+def explain_queries(connection: Connection) -> List[QueryPlan]:
+    """Run EXPLAIN (ANALYZE, BUFFERS) on every statement the routers execute, changing nothing"""
+    transaction = connection.begin()
+    try:
+        plans = []
+        for statement, parameters in capture_router_queries(connection):
+            # ANALYZE executes the statement, the savepoint undoes its writes
+            savepoint = connection.begin_nested()
+            try:
+                result = connection.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", parameters
+                )
+            except DBAPIError:  # Such as inserting a row the request inserted already
+                savepoint.rollback()
+                continue
+            explained = result.scalar()
+            savepoint.rollback()
+            explained = (json.loads(explained) if isinstance(explained, str) else explained)[0]
+            plans.append(
+                QueryPlan(
+                    statement=statement,
+                    execution_ms=explained["Execution Time"],
+                    shared_hit_blocks=explained["Plan"].get("Shared Hit Blocks", 0),
+                    shared_read_blocks=explained["Plan"].get("Shared Read Blocks", 0),
+                    seq_scans=find_seq_scans(explained["Plan"]),
+                )
+            )
+        return plans
+    finally:
+        transaction.rollback()
+
+
+def _explain_queries(args: argparse.Namespace):
+    with get_engine().connect() as connection:
+        plans = explain_queries(connection)
+    flagged = 0
+    for plan in plans:
+        statement = " ".join(plan.statement.split())
+        print(
+            f"{plan.execution_ms:9.3f} ms  hit={plan.shared_hit_blocks} read={plan.shared_read_blocks}  "
+            f"{statement[:args.width]}"
+        )
+        # Scanning a small table, or stopping early under a LIMIT, is what the planner should do
+        seq_scans = [
+            (table, rows)
+            for table, rows in plan.seq_scans
+            if rows >= args.min_rows and table not in args.ignore_table
+        ]
+        flagged += bool(seq_scans)
+        for table, rows in seq_scans:
+            print(f"{'':13}Seq Scan on {table} read {rows} rows")
+    print(f"{flagged} of {len(plans)} statement(s) scan a table sequentially")
+    if flagged:
+        raise SystemExit(1)
+
+
+def _refresh_rankings(args: argparse.Namespace):
+    db = SessionLocal()
+    try:
+        refreshed = refresh_all_rankings(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Refreshed the rankings of {refreshed} post(s)")
+
+
+def _purge_revoked_tokens(args: argparse.Namespace):
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            delete(models.RevokedToken)
+            .where(models.RevokedToken.expires_at < func.now())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+    print(f"Purged {result.rowcount} expired revocation(s)")
+
+
+def _purge_deleted_posts(args: argparse.Namespace):
+    async def purge():
+        async with session_scope() as db:
+            return await Purger(args.batch_size).purge(db)
+
+    votes, posts = asyncio.run(purge())
+    print(f"Purged {posts} deleted post(s) and {votes} vote(s)")
+
+
+def _reconcile_votes(args: argparse.Namespace):
+    db = SessionLocal()
+    try:
+        fixed = reconcile_votes(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Fixed the vote count of {fixed} post(s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = subparsers.add_parser(
+        "reconcile-votes", help="Recount posts.vote_count from the votes table"
+    )
+    reconcile.add_argument("--batch-size", type=int, default=1000)
+    reconcile.set_defaults(handler=_reconcile_votes)
+
+    rankings = subparsers.add_parser(
+        "refresh-rankings", help="Recompute the hot and top rankings of every post"
+    )
+    rankings.add_argument("--batch-size", type=int, default=10_000)
+    rankings.set_defaults(handler=_refresh_rankings)
+
+    purge = subparsers.add_parser(
+        "purge-revoked-tokens", help="Delete the revocations of the tokens which have expired since"
+    )
+    purge.set_defaults(handler=_purge_revoked_tokens)
+
+    purge_posts = subparsers.add_parser(
+        "purge-deleted-posts", help="Delete the deleted posts and their votes now, instead of waiting for the workers"
+    )
+    purge_posts.add_argument("--batch-size", type=int, default=1000)
+    purge_posts.set_defaults(handler=_purge_deleted_posts)
+
+    explain = subparsers.add_parser(
+        "explain-queries",
+        help="EXPLAIN (ANALYZE, BUFFERS) the statements of every route and flag sequential scans",
+        description="Run it against a seeded database (python -m benchmarks.seed), the planner "
+        "rightly prefers sequential scans on tiny tables. Nothing is written.",
+    )
+    explain.add_argument(
+        "--ignore-table", action="append", default=[], help="a table allowed to be scanned, repeatable"
+    )
+    explain.add_argument(
+        "--min-rows", type=int, default=1000, help="flag the sequential scans reading at least this many rows"
+    )
+    explain.add_argument("--width", type=int, default=120, help="characters of each statement to print")
+    explain.set_defaults(handler=_explain_queries)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
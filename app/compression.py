@@ -0,0 +1,186 @@
+"""Compression of the responses: zstd, brotli or gzip, whichever the client accepts first in settings.compression_encodings
+
+Bodies under settings.compression_minimum_size go out as they are. Those over
+settings.compression_threadpool_size are compressed in the threadpool, the compressors release
+the GIL, so a large page doesn't hold up the event loop. Streamed bodies, like GET /posts/export,
+are compressed chunk by chunk as they are sent.
+
+A response with an ETag, like those of app.cache.ResponseCache, is the same body as long as its
+ETag is the same: its compressed body is cached per worker under the ETag and the encoding, so
+serving a cached page again doesn't compress it again.
+"""
+import zlib
+from typing import Callable, Dict, Optional, Sequence
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from . import metrics
+from .cache import TTLCache
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # br is left out
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # zstd is left out
+    zstandard = None
+
+
+UNCOMPRESSED_BYTES = metrics.Counter(
+    "response_uncompressed_bytes_total", "Bytes of the compressed response bodies, before compression", ["encoding"]
+)
+COMPRESSED_BYTES = metrics.Counter(
+    "response_compressed_bytes_total", "Bytes of the compressed response bodies, as sent", ["encoding"]
+)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class _BrotliCompressor:
+    # The interface of zlib's compress objects
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+# Encoding -> a new compress object, with compress(data) and flush() at the end
+COMPRESSORS: Dict[str, Callable] = {
+    "gzip": lambda: zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31),
+}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda: _BrotliCompressor(settings.compression_brotli_level)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda: zstandard.ZstdCompressor(level=settings.compression_zstd_level).compressobj()
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(data) + compressor.flush()
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """The encodings of an Accept-Encoding header and their q-values"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        encoding, *params = (part.strip() for part in item.split(";"))
+        if not encoding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[encoding.lower()] = q
+    return accepted
+
+
+compressed_bodies = TTLCache("compressed_responses", settings.compression_cache_size, ttl=None)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, encodings: Sequence[str]):
+        self.app = app
+        # In order of preference, of those which are installed
+        self.encodings = [
+            encoding for encoding in (encoding.strip().lower() for encoding in encodings) if encoding in COMPRESSORS
+        ]
+
+    def choose(self, accept_encoding: str) -> Optional[str]:
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in self.encodings:
+            if accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = self.choose(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, _CompressingSend(send, encoding))
+
+
+async def _run(function: Callable[[bytes], bytes], data: bytes) -> bytes:
+    if len(data) > settings.compression_threadpool_size:
+        return await run_in_threadpool(function, data)
+    return function(data)
+
+
+class _CompressingSend:
+    """The send of a response, compressing its body unless it's too small or not compressible"""
+
+    def __init__(self, send, encoding: str):
+        self.send = send
+        self.encoding = encoding
+        self.start: Optional[dict] = None
+        self.compressor = None  # Set while streaming a compressed body
+        self.passthrough = False
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        return (
+            self.start["status"] not in (204, 304)
+            and "content-encoding" not in headers
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+        )
+
+    async def _compress_whole(self, body: bytes, etag: Optional[str]) -> bytes:
+        key = (etag, self.encoding)
+        compressed = compressed_bodies.get(key) if etag else None
+        if compressed is None:
+            compressed = await _run(lambda data: compress(self.encoding, data), body)
+            if etag:
+                compressed_bodies.set(key, compressed)
+        return compressed
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message  # Sent along with the first part of the body
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            return await self.send(message)
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:  # The first part of the body
+            headers = MutableHeaders(raw=list(self.start.get("headers", [])))
+            if not self._compressible(headers) or (not more_body and len(body) < settings.compression_minimum_size):
+                self.passthrough = True
+                await self.send(self.start)
+                return await self.send(message)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # The compressed body isn't byte for byte the one the strong ETag stands for
+                headers["ETag"] = f"W/{etag}"
+            UNCOMPRESSED_BYTES.inc(len(body), encoding=self.encoding)
+            if not more_body:
+                compressed = await self._compress_whole(body, etag)
+                COMPRESSED_BYTES.inc(len(compressed), encoding=self.encoding)
+                headers["Content-Length"] = str(len(compressed))
+                await self.send({**self.start, "headers": headers.raw})
+                return await self.send({"type": "http.response.body", "body": compressed})
+            del headers["Content-Length"]
+            self.compressor = COMPRESSORS[self.encoding]()
+            await self.send({**self.start, "headers": headers.raw})
+        else:
+            UNCOMPRESSED_BYTES.inc(len(body), encoding=self.encoding)
+
+        compressed = await _run(self.compressor.compress, body) if body else b""
+        if not more_body:
+            compressed += self.compressor.flush()
+        COMPRESSED_BYTES.inc(len(compressed), encoding=self.encoding)
+        if compressed or not more_body:
+            await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
@@ -1,22 +1,331 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base
+import csv
+import io
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Type, Union
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import Engine, Result, Row
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
 
+from . import metrics
 from .config import settings
 
-if not settings.database_password:
-    SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
-else:
-    SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def database_url(async_driver: bool = False) -> str:
+    # SQLAlchemy 1.4 only speaks async Postgres through asyncpg
+    scheme = "postgresql+asyncpg" if async_driver else "postgresql"
+    if not settings.database_password:
+        return f"{scheme}://{settings.database_username}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
+    return f"{scheme}://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
+
+
+POOL_CHECKOUTS = metrics.Counter("db_pool_checkouts_total", "Connections checked out of the pool", ["pool"])
+POOL_OVERFLOW_CHECKOUTS = metrics.Counter(
+    "db_pool_overflow_checkouts_total", "Checkouts made while overflow connections were open", ["pool"]
+)
+POOL_TIMEOUTS = metrics.Counter("db_pool_timeouts_total", "Checkouts which gave up after pool_timeout", ["pool"])
+POOL_WAIT = metrics.Histogram("db_pool_checkout_seconds", "Time spent waiting for a connection", ["pool"])
+POOL_CHECKED_OUT = metrics.Gauge("db_pool_checked_out", "Connections currently checked out", ["pool"])
+POOL_OVERFLOW = metrics.Gauge("db_pool_overflow", "Overflow connections currently open", ["pool"])
+
+_pools: Dict[str, QueuePool] = {}
+
+
+class RecentAverage:
+    """Moving average of the samples, which decays towards 0 over tau seconds without new ones"""
+
+    def __init__(self, weight: float = 0.2, tau: float = 1.0):
+        self.weight = weight
+        self.tau = tau
+        self._value = 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _decayed(self, now: float) -> float:
+        return self._value * math.exp(-(now - self._updated_at) / self.tau)
+
+    def add(self, sample: float):
+        with self._lock:
+            now = time.monotonic()
+            value = self._decayed(now)
+            self._value = value + (sample - value) * self.weight
+            self._updated_at = now
+
+    def value(self) -> float:
+        return self._decayed(time.monotonic())
+
+
+# Seconds spent waiting for a connection lately, by the pools of this worker
+recent_pool_wait = RecentAverage()
+
+
+def instrumented_pool(pool_class: Type[QueuePool], name: str) -> Type[QueuePool]:
+    """Subclass pool_class to report its checkouts in the metrics, labelled with name"""
+
+    class InstrumentedPool(pool_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            _pools[name] = self
+
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                connection = super().connect()
+            except exc.TimeoutError:
+                POOL_TIMEOUTS.inc(pool=name)
+                raise
+            wait = time.perf_counter() - start
+            POOL_WAIT.observe(wait, pool=name)
+            recent_pool_wait.add(wait)
+            POOL_CHECKOUTS.inc(pool=name)
+            if self.overflow() > 0:
+                POOL_OVERFLOW_CHECKOUTS.inc(pool=name)
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+@metrics.on_collect
+def _collect_pool_usage():
+    for name, pool in _pools.items():
+        POOL_CHECKED_OUT.set(pool.checkedout(), pool=name)
+        POOL_OVERFLOW.set(max(pool.overflow(), 0), pool=name)
+
+
+def pool_options(pool_class: Type[QueuePool], name: str) -> Dict[str, Any]:
+    # Each gunicorn worker gets its own pool, the server sees up to workers * (pool_size + max_overflow) connections
+    return {
+        "poolclass": instrumented_pool(pool_class, name),
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        "pool_timeout": settings.database_pool_timeout,
+        "pool_recycle": settings.database_pool_recycle,
+        "pool_pre_ping": settings.database_pool_pre_ping,
+    }
+
+
+# Created on first use rather than at import, so that importing the app, in the gunicorn master
+# with --preload or in the tests, neither needs the database nor opens pools the workers would share
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_engines_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    global _engine
+    with _engines_lock:
+        if _engine is None:
+            _engine = create_engine(database_url(), **pool_options(QueuePool, "sync"))
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    with _engines_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine(
+                database_url(async_driver=True),
+                **pool_options(AsyncAdaptedQueuePool, "async"),
+            )
+    return _async_engine
+
+
+def create_routes_engine(url: str, pool_name: str) -> Union[Engine, AsyncEngine]:
+    """An engine on url for the driver the routes use, sync or async, such as a replica's"""
+    if settings.async_database:
+        return create_async_engine(
+            url.replace("postgresql://", "postgresql+asyncpg://", 1),
+            **pool_options(AsyncAdaptedQueuePool, pool_name),
+        )
+    return create_engine(url, **pool_options(QueuePool, pool_name))
+
+
+def _dispose_engines_after_fork():
+    # A forked worker must not use the connections of its parent: they are dropped without being
+    # closed, which would close them for the parent too
+    for engine_ in (_engine, _async_engine and _async_engine.sync_engine):
+        if engine_ is not None:
+            engine_.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engines_after_fork)
+
+
+async def dispose_engines():
+    global _engine, _async_engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+# The routers return ORM objects after committing, so don't expire them on commit
+_session_factory = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+_async_session_factory = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
+
+def SessionLocal() -> Session:
+    return _session_factory(bind=get_engine())
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    return _async_session_factory(bind=get_async_engine())
+
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+
+class ThreadedSession:
+    """The part of the AsyncSession interface the routers use, on top of a sync Session.
+
+    Each call runs in Starlette's threadpool, so the same async handlers work on the sync engine
+    when settings.async_database is off.
+    """
+
+    def __init__(self, sync_session: Session):
+        self.sync_session = sync_session
+
+    @property
+    def bind(self):
+        return self.sync_session.get_bind()
+
+    def add(self, instance: Any):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def stream(self, statement, params=None, **kwargs) -> "ThreadedResult":
+        """Execute statement with a server side cursor, like AsyncSession.stream"""
+        result = await run_in_threadpool(
+            self.sync_session.execute, statement.execution_options(stream_results=True), params, **kwargs
+        )
+        return ThreadedResult(result)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def refresh(self, instance: Any, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance: Any):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+
+
+class ThreadedResult:
+    """The part of the AsyncResult interface the routers use, fetching from a sync Result in the threadpool"""
+
+    def __init__(self, result: Result):
+        self.result = result
+
+    async def partitions(self, size: Optional[int] = None) -> AsyncIterator[List[Row]]:
+        partitions = self.result.partitions(size)
+        while True:
+            rows = await run_in_threadpool(next, partitions, None)
+            if rows is None:
+                return
+            yield rows
+
+
+def _copy_csv(session: Session, table_name: str, columns: List[str], rows: List[tuple]):
+    buffer = io.StringIO()
+    # Quoted, the empty strings aren't read as NULL
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
     try:
-        yield db
+        cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
     finally:
-        db.close()
\ No newline at end of file
+        cursor.close()
+
+
+async def copy_rows(db: Union[ThreadedSession, AsyncSession], table_name: str, columns: List[str], rows: List[tuple]):
+    """Load rows into the table with COPY, in the transaction of db.
+
+    Goes through the driver of the session: psycopg2's copy_expert, or asyncpg's binary copy. On
+    asyncpg a statement must have begun the transaction, else the copy commits on its own.
+    """
+    if isinstance(db, ThreadedSession):
+        await db.run_sync(_copy_csv, table_name, columns, rows)
+        return
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(table_name, records=rows, columns=columns)
+
+
+def open_session(engine: Union[Engine, AsyncEngine]) -> Union[ThreadedSession, AsyncSession]:
+    """A session on engine, of the kind get_db yields"""
+    if isinstance(engine, AsyncEngine):
+        return _async_session_factory(bind=engine)
+    return ThreadedSession(_session_factory(bind=engine))
+
+
+async def get_db():
+    if settings.async_database:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = ThreadedSession(SessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+# A session outside of the requests, such as in background loops and tasks. Those of the routes look
+# it up as database.session_scope, so it can be replaced along with the get_db dependency
+session_scope = asynccontextmanager(get_db)
+
+
+ALEMBIC_SCRIPT_LOCATION = Path(__file__).resolve().parent.parent / "alembic"
+
+
+def alembic_head() -> str:
+    config = Config()
+    config.set_main_option("script_location", str(ALEMBIC_SCRIPT_LOCATION))
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+async def check_revision(db):
+    """Fail unless the database was migrated to the latest Alembic revision, which the models expect"""
+    current = await db.run_sync(lambda session: MigrationContext.configure(session.connection()).get_current_revision())
+    head = alembic_head()
+    if current != head:
+        raise RuntimeError(f"The database is at revision {current}, not {head}: run `alembic upgrade head`")
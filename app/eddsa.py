@@ -0,0 +1,70 @@
+"""EdDSA (Ed25519) keys for python-jose, which only signs with HMAC, RSA and ECDSA keys itself
+
+Importing this module registers the "EdDSA" algorithm of RFC 8037 with jose, backed by cryptography.
+"""
+from typing import Union
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from jose import jwk
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+
+
+ALGORITHM = "EdDSA"
+
+
+class Ed25519Key(Key):
+    """Private or public Ed25519 key, from its PEM encoding or its cryptography object"""
+
+    def __init__(self, key: Union[str, bytes, Ed25519PrivateKey, Ed25519PublicKey], algorithm: str):
+        if algorithm != ALGORITHM:
+            raise JWKError(f"Ed25519 keys can't be used with {algorithm}")
+        self._algorithm = algorithm
+        if isinstance(key, str):
+            key = key.encode()
+        if isinstance(key, bytes):
+            try:
+                key = serialization.load_pem_private_key(key, password=None)
+            except ValueError:
+                try:
+                    key = serialization.load_pem_public_key(key)
+                except ValueError as e:
+                    raise JWKError(f"Not a PEM key: {e}")
+        if not isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+            raise JWKError(f"Not an Ed25519 key: {type(key).__name__}")
+        self._key = key
+
+    def is_public(self) -> bool:
+        return isinstance(self._key, Ed25519PublicKey)
+
+    def sign(self, msg: bytes) -> bytes:
+        if self.is_public():
+            raise JWKError("Public keys can't sign")
+        return self._key.sign(msg)
+
+    def verify(self, msg: bytes, sig: bytes) -> bool:
+        public_key = self._key if self.is_public() else self._key.public_key()
+        try:
+            public_key.verify(sig, msg)
+        except InvalidSignature:
+            return False
+        return True
+
+    def public_key(self) -> "Ed25519Key":
+        if self.is_public():
+            return self
+        return Ed25519Key(self._key.public_key(), self._algorithm)
+
+    def to_pem(self) -> bytes:
+        if self.is_public():
+            return self._key.public_bytes(
+                serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+            )
+        return self._key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+
+
+jwk.register_key(ALGORITHM, Ed25519Key)
@@ -0,0 +1,119 @@
+"""Count and time the SQL statements of each request
+
+The SQLAlchemy cursor events of every engine feed the RequestStats of the request being served,
+which QueryStatsMiddleware reports in a Server-Timing header and in per route histograms.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DURATION = metrics.Histogram(
+    "http_request_duration_seconds", "Time to answer a request", ["method", "route"]
+)
+REQUEST_DB_SECONDS = metrics.Histogram(
+    "http_request_db_seconds", "Time spent executing SQL statements per request", ["method", "route"]
+)
+REQUEST_DB_STATEMENTS = metrics.Histogram(
+    "http_request_db_statements",
+    "SQL statements executed per request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement: Optional[str] = None
+
+    def record(self, statement: str, seconds: float):
+        self.statements += 1
+        self.db_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.db_seconds * 1000:.3f};desc="{self.statements} statements", '
+            f"db-slowest;dur={self.slowest_seconds * 1000:.3f}"
+        )
+
+
+# Mutated, never set, by the statements: the sync sessions run them in threads holding a copy
+# of the request's context
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    context._statement_started_at = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "_statement_started_at", None)
+    if started_at is None:  # Started before this module was imported
+        return
+    seconds = time.perf_counter() - started_at
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    if settings.slow_statement_ms and seconds * 1000 >= settings.slow_statement_ms:
+        logger.warning("Slow statement (%.1f ms): %s", seconds * 1000, " ".join(statement.split()))
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware collecting the RequestStats of each HTTP request.
+
+    Statements executed after the response headers are sent, by a streaming body, are counted
+    in the histograms but not in the header.
+    """
+
+    def __init__(self, app, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+        self._route_paths: Optional[Dict] = None
+
+    def route_path(self, scope) -> str:
+        # Templated paths keep the label count bounded, unlike the raw ones
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started_at = time.perf_counter()
+
+        async def send_with_server_timing(message):
+            if message["type"] == "http.response.start" and self.server_timing:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", stats.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            _request_stats.reset(token)
+            labels = {"method": scope["method"], "route": self.route_path(scope)}
+            REQUEST_DURATION.observe(time.perf_counter() - started_at, **labels)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, **labels)
+            REQUEST_DB_STATEMENTS.observe(stats.statements, **labels)
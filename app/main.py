@@ -1,18 +1,47 @@
+from contextlib import asynccontextmanager
 from typing import Dict
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from . import models
-from .database import engine
-from .routers import post, user, auth, vote
+from . import database, oauth2, utils
+from .compression import CompressionMiddleware
+from .config import get_settings, settings
+from .instrumentation import QueryStatsMiddleware
+from .purge import purger
+from .ratelimit import RateLimitMiddleware, storage
+from .replicas import replica_set
+from .routers import post, user, auth, vote, metrics
 
 
-models.Base.metadata.create_all(
-    bind=engine
-)  # This will create the tables that don't exist from the models
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resolved already if the import needed it, otherwise read here rather than at import
+    settings = get_settings()
+    try:
+        # The tables come from the Alembic migrations, the app only checks they were applied
+        if settings.check_database_revision:
+            async with database.session_scope() as db:
+                await database.check_revision(db)
+        await oauth2.start_revocation_sync()
+        replica_set.start(settings.replica_health_interval)
+        purger.start(settings.purge_interval_seconds)
+        yield
+    finally:
+        await purger.stop()
+        await replica_set.stop()
+        await oauth2.stop_revocation_sync()
+        utils.shutdown_hash_executor()
+        await database.dispose_engines()
+
 
 # TODO Make typing better for the return types
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+# FastAPI 0.89 doesn't take the lifespan argument of Starlette yet
+app.router.lifespan_context = lifespan
+
+# Inside CORSMiddleware, so browsers can read its 429 and 503 responses
+app.add_middleware(RateLimitMiddleware, storage=storage)
 
 # Allow origins from domains
 # origins = [
@@ -32,11 +61,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outside CORSMiddleware and the rate limits, so their responses are compressed too
+app.add_middleware(CompressionMiddleware, encodings=settings.compression_encodings.split(","))
+
+# Added last so it is the outermost middleware and times the whole request
+app.add_middleware(QueryStatsMiddleware, server_timing=settings.server_timing)
 
 app.include_router(post.router)
 app.include_router(user.router)
 app.include_router(auth.router)
 app.include_router(vote.router)
+app.include_router(metrics.router)
 
 
 # This could be an async function
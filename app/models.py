@@ -1,6 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql.expression import text
+from sqlalchemy import DDL, Column, Float, ForeignKey, Index, Integer, String, Boolean, event, text
+from sqlalchemy.orm import relationship, synonym
+from sqlalchemy.sql import func
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 
 from .database import Base
@@ -13,10 +13,45 @@ class Post(Base):
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     published = Column(Boolean, nullable=True, server_default="TRUE")
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
-    
+    # Maintained by routers/vote.py so reads don't have to count the votes table
+    vote_count = Column(Integer, nullable=False, server_default="0")
+    # Incremented by each update, for the If-Match of routers/post.py
+    version = Column(Integer, nullable=False, server_default="1")
+    # Set by DELETE /posts/{id}, the reads skip the post until app/purge.py deletes it and its votes
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
     owner = relationship("User")
+    votes = synonym("vote_count")  # Exposed as `votes` by schemas.PostWithVotes
+
+    __table_args__ = (
+        # Keyset pagination of the feed walks this index backwards
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        # Cascading deletes from users and the per user queries
+        Index("ix_posts_user_id", "user_id"),
+        # The purge finds the deleted posts, few at any time
+        Index("ix_posts_deleted_at", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
+
+
+class PostRanking(Base):
+    """Scores of the hot and top feeds, maintained by app/ranking.py.
+
+    Kept out of posts so that a vote only updates the unindexed posts.vote_count, the score
+    indexes being rewritten later, in the background.
+    """
+
+    __tablename__ = "post_rankings"
+
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
+    votes = Column(Integer, nullable=False)
+    hot = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_post_rankings_hot_post_id", "hot", "post_id"),
+        Index("ix_post_rankings_votes_post_id", "votes", "post_id"),
+    )
 
 
 class User(Base):
@@ -25,7 +60,24 @@ class User(Base):
     id = Column(Integer, primary_key=True, nullable=False)
     email = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class RevokedToken(Base):
+    """Ids (jti) of the revoked tokens, or of the token families (fam) revoked at once, see app/revocation.py"""
+
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String, primary_key=True, nullable=False)
+    revoked_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    # Past it the tokens are rejected anyway and the row can be purged
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # The workers reload the recent revocations
+        Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
 
 
 class Vote(Base):
@@ -33,4 +85,24 @@ class Vote(Base):
 
     post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+    # The primary key starts with post_id, it can't serve lookups by user
+    __table_args__ = (
+        Index("ix_votes_user_id", "user_id"),
+        # Split by post so purging the votes of a post, or counting them, stays within one partition
+        {"postgresql_partition_by": "HASH (post_id)"},
+    )
+
+
+VOTE_PARTITIONS = 8
+
+for remainder in range(VOTE_PARTITIONS):
+    event.listen(
+        Vote.__table__,
+        "after_create",
+        DDL(
+            f"CREATE TABLE votes_p{remainder} PARTITION OF votes "
+            f"FOR VALUES WITH (MODULUS {VOTE_PARTITIONS}, REMAINDER {remainder})"
+        ).execute_if(dialect="postgresql"),
+    )
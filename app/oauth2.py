@@ -1,12 +1,19 @@
-from datetime import datetime, timedelta
-from typing import Dict
+import time
+import uuid
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import schemas, database, models
+from . import schemas, models
+from . import eddsa  # noqa: F401, registers the EdDSA algorithm with jose
+from .cache import ModelCache, TTLCache, shared_backend
 from .config import settings
+from .replicas import get_read_db
+from .revocation import RevocationList
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -15,33 +22,131 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+REFRESH_TOKEN_EXPIRE_DAYS = settings.refresh_token_expire_days
 
 
-def create_access_token(data: Dict):
+def load_keys(algorithm: str, secret_key: str, private_key: str = "", public_key: str = "") -> Tuple[Key, Key]:
+    """The keys signing and verifying the tokens: secret_key for the HMAC algorithms (HS256...),
+    the private and public keys for the others"""
+    if algorithm.startswith("HS"):
+        key = jwk.construct(secret_key, algorithm)
+        return key, key
+    if not private_key:
+        raise ValueError(f"{algorithm} signs with a private key, set JWT_PRIVATE_KEY")
+    signing_key = jwk.construct(private_key, algorithm)
+    verifying_key = jwk.construct(public_key, algorithm) if public_key else signing_key.public_key()
+    return signing_key, verifying_key
+
+
+# Constructed once, jose would parse the key again for every token otherwise
+SIGNING_KEY, VERIFYING_KEY = load_keys(ALGORITHM, SECRET_KEY, settings.jwt_private_key, settings.jwt_public_key)
+
+# Spares verifying the signature of every request. A token is only its own key, so a hit is a
+# token verified before, and it's dropped when it expires
+verified_tokens = TTLCache("tokens", settings.token_cache_size, ttl=None)
+
+# Checked by every request instead of the revoked_tokens table
+revocation_list = RevocationList(window=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+async def start_revocation_sync():
+    revocation_list.start(settings.revocation_sync_seconds)
+
+
+async def stop_revocation_sync():
+    await revocation_list.stop()
+
+# Spares the users lookup of every authenticated request
+user_cache = ModelCache(
+    "users", schemas.UserResponse, settings.user_cache_size, settings.user_cache_ttl, shared_backend
+)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _forget_cached_user(mapper, connection, target):
+    # Only reaches this worker's copy, routes changing users should also await invalidate_user
+    user_cache.local.delete(target.id)
+
+
+async def invalidate_user(user_id: int):
+    await user_cache.invalidate(user_id)
+
+
+def create_access_token(data: Dict, family: Optional[str] = None):
+    # The tokens issued from one login, by refreshing, share their family. Revoking it revokes them all
+    token_id = uuid.uuid4().hex
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode["exp"] = expire
+    to_encode.update(jti=token_id, fam=family or token_id)
+    to_encode["exp"] = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
 
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, SIGNING_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
 
 
+def create_refresh_token(data: Dict, family: str):
+    to_encode = data.copy()
+    to_encode.update(jti=uuid.uuid4().hex, fam=family, type="refresh")
+    to_encode["exp"] = int(time.time()) + REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    return jwt.encode(to_encode, SIGNING_KEY, algorithm=ALGORITHM)
+
+
+def create_tokens(user_id: int, family: Optional[str] = None) -> Dict[str, str]:
+    """The content of a schemas.Token, family being the one of the refresh token replaced if any"""
+    family = family or uuid.uuid4().hex
+    return {
+        "access_token": create_access_token({"user_id": user_id}, family),
+        "refresh_token": create_refresh_token({"user_id": user_id}, family),
+        "token_type": "bearer",
+    }
+
+
 def verify_access_token(token: str, credentials_exception):
+    token_data = verified_tokens.get(token)
+    if token_data is not None:
+        return token_data
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, VERIFYING_KEY, algorithms=[ALGORITHM])
         id: str = payload.get("user_id")
-        if id is None:
+        if id is None or payload.get("type") == "refresh":
             raise credentials_exception
-        token_data = schemas.TokenData(id=id)
+        token_data = schemas.TokenData(id=id, jti=payload.get("jti"), family=payload.get("fam"))
     except JWTError:
         raise credentials_exception
+    expires_at = payload.get("exp")
+    if expires_at is not None:
+        verified_tokens.set(token, token_data, ttl=expires_at - time.time())
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
+def verify_refresh_token(token: str, credentials_exception) -> Dict:
+    """The claims of the refresh token, which is single use: check it against revoked_tokens too"""
+    try:
+        payload = jwt.decode(token, VERIFYING_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("type") != "refresh" or None in (payload.get("user_id"), payload.get("jti"), payload.get("fam")):
+        raise credentials_exception
+    return payload
+
+
+def invalid_credentials() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
+    credentials_exception = invalid_credentials()
     token = verify_access_token(token=token, credentials_exception=credentials_exception)
+    if token.jti in revocation_list or token.family in revocation_list:
+        raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.id == token.id).first()
-    return schemas.UserResponse.from_orm(user)
\ No newline at end of file
+    user_id = int(token.id)
+    user = await user_cache.get(user_id)
+    if user is None:
+        db_user = await db.get(models.User, user_id)
+        if not db_user:  # Deleted since the token was issued
+            raise credentials_exception
+        user = schemas.UserResponse.from_orm(db_user)
+        await user_cache.set(user_id, user)
+    return user
\ No newline at end of file
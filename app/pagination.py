@@ -0,0 +1,27 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+from . import models
+
+# posts.id is an int4, an id out of its range would fail in the database instead
+MAX_ID = 2**31 - 1
+
+
+# Cursors are opaque to the clients, they only need to send back the next_cursor they received
+def encode_cursor(post: models.Post) -> str:
+    position = json.dumps([post.created_at.isoformat(), post.id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Return the (created_at, id) position encoded in cursor, raise ValueError if it is malformed"""
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError, UnicodeError, OverflowError):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    if type(id) is not int or not -MAX_ID - 1 <= id <= MAX_ID:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return created_at, id
@@ -0,0 +1,101 @@
+"""Purge of the deleted posts, which DELETE /posts/{id} only marks with deleted_at
+
+Deleting a post and its votes at once would take as long as it has votes, in the request. Each step
+of the purge deletes at most batch_size votes of deleted posts, or once those are gone at most
+batch_size of the posts, and commits. The workers all run the purge, an advisory lock lets one of
+them at a time do a step.
+"""
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, exists, func, select, tuple_
+
+from . import metrics, models
+from .config import settings
+from .database import session_scope
+
+
+logger = logging.getLogger(__name__)
+
+PURGED = metrics.Counter("purged_rows_total", "Rows of the deleted posts purged", ["table"])
+
+# Key of the pg_try_advisory_xact_lock taken by each step
+PURGE_LOCK = 0x70757267
+
+DELETED = models.Post.deleted_at.isnot(None)
+
+
+class Purger:
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def step(self, db) -> Tuple[int, int]:
+        """Delete a batch of the votes or of the deleted posts, return how many (votes, posts)"""
+        if not await db.scalar(select(func.pg_try_advisory_xact_lock(PURGE_LOCK))):
+            await db.rollback()
+            return 0, 0  # Another worker is purging
+        votes = (
+            select(models.Vote.post_id, models.Vote.user_id)
+            .join(models.Post, models.Post.id == models.Vote.post_id)
+            .where(DELETED)
+            .limit(self.batch_size)
+        )
+        result = await db.execute(
+            delete(models.Vote)
+            .where(tuple_(models.Vote.post_id, models.Vote.user_id).in_(votes))
+            .execution_options(synchronize_session=False)
+        )
+        purged_votes = result.rowcount
+        purged_posts = 0
+        if purged_votes < self.batch_size:
+            # The posts without votes left. A vote slipping in meanwhile goes with the ON DELETE CASCADE
+            posts = (
+                select(models.Post.id)
+                .where(DELETED, ~exists().where(models.Vote.post_id == models.Post.id))
+                .limit(self.batch_size - purged_votes)
+            )
+            result = await db.execute(
+                delete(models.Post).where(models.Post.id.in_(posts)).execution_options(synchronize_session=False)
+            )
+            purged_posts = result.rowcount
+        await db.commit()
+        PURGED.inc(purged_votes, table="votes")
+        PURGED.inc(purged_posts, table="posts")
+        return purged_votes, purged_posts
+
+    async def purge(self, db) -> Tuple[int, int]:
+        """Step until there is nothing left to purge, return how many (votes, posts) were"""
+        votes = posts = 0
+        while True:
+            purged_votes, purged_posts = await self.step(db)
+            if not purged_votes and not purged_posts:
+                return votes, posts
+            votes += purged_votes
+            posts += purged_posts
+
+    async def purge_forever(self, interval: float):
+        while True:
+            try:
+                async with session_scope() as db:
+                    await self.purge(db)
+            except Exception:
+                logger.exception("Couldn't purge the deleted posts")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float):
+        if interval:
+            self._task = asyncio.get_running_loop().create_task(self.purge_forever(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+purger = Purger(settings.purge_batch_size)
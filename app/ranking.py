@@ -0,0 +1,76 @@
+"""Rankings of the hot and top feeds, stored in post_rankings so reading a page is an index scan
+
+The hot score of a post is log10(votes + 1) + created_at / settings.hot_decay_seconds, with
+created_at in seconds since the epoch. Recency is part of the score instead of decaying it, so a
+score only changes when the votes of its post do: the routes refresh the rankings of the posts
+they changed in a background task, after answering. `python -m app.commands refresh-rankings`
+rebuilds them all.
+"""
+from typing import Iterable, Optional
+
+from sqlalchemy import Float, cast, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from . import models, schemas
+from .config import settings
+
+
+def _scores() -> Select:
+    hot = func.log(models.Post.vote_count + 1) + (
+        cast(func.extract("epoch", models.Post.created_at), Float) / settings.hot_decay_seconds
+    )
+    return select(models.Post.id, models.Post.vote_count, cast(hot, Float))
+
+
+def _upsert(scores: Select):
+    statement = insert(models.PostRanking).from_select(["post_id", "votes", "hot"], scores)
+    return statement.on_conflict_do_update(
+        index_elements=[models.PostRanking.post_id],
+        set_={"votes": statement.excluded.votes, "hot": statement.excluded.hot},
+    )
+
+
+async def refresh_rankings(db: AsyncSession, post_ids: Iterable[int]):
+    """Recompute the rankings of the posts from their current vote counts"""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    await db.execute(_upsert(_scores().where(models.Post.id.in_(post_ids))))
+    await db.commit()
+
+
+def refresh_all_rankings(db: Session, batch_size: int = 10_000) -> int:
+    """Recompute every ranking in batches of posts, each committed on its own. Returns the post count"""
+    refreshed = 0
+    last_id = 0
+    while True:
+        batch_ids = (
+            db.query(models.Post.id)
+            .filter(models.Post.id > last_id)
+            .order_by(models.Post.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch_ids:
+            return refreshed
+        batch_last_id = batch_ids[-1][0]
+        db.execute(_upsert(_scores().where(models.Post.id > last_id, models.Post.id <= batch_last_id)))
+        db.commit()
+        refreshed += len(batch_ids)
+        last_id = batch_last_id
+
+
+def order_feed(query: Select, sort: Optional[schemas.PostSort]) -> Select:
+    """Order a select of posts for the feed sorted by sort"""
+    if sort is None:
+        return query
+    if sort == schemas.PostSort.new:
+        return query.order_by(models.Post.created_at.desc(), models.Post.id.desc())
+    # The posts created since the last refresh have no ranking yet, they appear once it's done
+    score = models.PostRanking.hot if sort == schemas.PostSort.hot else models.PostRanking.votes
+    return query.join(models.PostRanking, models.PostRanking.post_id == models.Post.id).order_by(
+        score.desc(), models.PostRanking.post_id.desc()
+    )
@@ -0,0 +1,192 @@
+"""Rate limits and load shedding of the auth and write routes
+
+Each route of RULES takes a token from a bucket per user, or per client IP for the anonymous
+requests, and answers 429 once it's empty. The user comes from the access token alone, as verified
+(and cached) by oauth2, so limiting costs no database query. The buckets are kept by each worker,
+unless settings.rate_limit_storage shares them, like BackendStorage does through the cache backend.
+
+While the worker is overloaded, its database pool making requests wait or too many requests being
+in flight, the same routes answer 503 instead, so that the reads keep being served.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+
+from . import metrics, oauth2
+from .cache import CacheBackend, load_backend, shared_backend
+from .config import settings
+from .database import recent_pool_wait
+
+
+RATE_LIMITED = metrics.Counter(
+    "rate_limited_requests_total", "Requests refused with 429 by the rate limits", ["limit"]
+)
+SHED = metrics.Counter("shed_requests_total", "Requests refused with 503 while overloaded", ["limit"])
+IN_FLIGHT = metrics.Gauge("http_requests_in_flight", "Requests being served by the worker")
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+class Limit(NamedTuple):
+    """count requests per period seconds, all of which can be made at once"""
+
+    count: int
+    period: float
+
+
+def parse_limit(value: str) -> Optional[Limit]:
+    """Parse "<count>/<second|minute|hour>", None for an empty value"""
+    if not value:
+        return None
+    count, _, period = value.partition("/")
+    return Limit(int(count), PERIODS[period.strip()])
+
+
+_auth_limit = parse_limit(settings.rate_limit_auth)
+_writes_limit = parse_limit(settings.rate_limit_writes)
+
+# (method, path without its trailing slash) -> (bucket, limit). The routes of a bucket share its tokens
+RULES: Dict[Tuple[str, str], Tuple[str, Optional[Limit]]] = {
+    ("POST", "/login"): ("auth", _auth_limit),
+    ("POST", "/token/refresh"): ("auth", _auth_limit),
+    ("POST", "/users"): ("auth", _auth_limit),
+    ("POST", "/posts"): ("writes", _writes_limit),
+    ("POST", "/posts/bulk"): ("writes", _writes_limit),
+    ("POST", "/votes"): ("writes", _writes_limit),
+    ("POST", "/votes/batch"): ("writes", _writes_limit),
+}
+
+
+class RateLimitStorage:
+    """Token buckets, such as Redis ones shared by the workers"""
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Take a token from the bucket of key, return 0 or the seconds before one is available"""
+        raise NotImplementedError
+
+
+class MemoryStorage(RateLimitStorage):
+    """Buckets of this worker only, so each worker allows the whole limit.
+
+    The least recently used buckets are dropped past maxsize, which refills them.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        # key -> (tokens, when they were counted)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, limit: Limit) -> float:
+        rate = limit.count / limit.period
+        now = time.monotonic()
+        with self._lock:
+            tokens, counted_at = self._buckets.pop(key, (limit.count, now))
+            tokens = min(limit.count, tokens + (now - counted_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class BackendStorage(RateLimitStorage):
+    """Buckets in the CacheBackend of settings.cache_backend, so the workers share the limits.
+
+    A bucket is stored as its tokens and the wall clock time they were counted at, refilled like
+    MemoryStorage does, and written back with compare_and_set: if another worker took a token
+    meanwhile, the take starts over from the bucket it left.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None):
+        self.backend = backend or shared_backend
+        if self.backend is None:
+            raise ValueError("BackendStorage needs a shared backend, set settings.cache_backend")
+
+    async def take(self, key: str, limit: Limit) -> float:
+        rate = limit.count / limit.period
+        shared_key = f"ratelimit:{key}"
+        while True:  # Each failed compare_and_set is a token taken by another request
+            raw = await self.backend.get(shared_key)
+            now = time.time()
+            tokens, counted_at = map(float, raw.split(b":")) if raw is not None else (limit.count, now)
+            # max(): the clocks of the workers may disagree a little
+            tokens = min(limit.count, tokens + max(now - counted_at, 0) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            tokens -= 1
+            # Past the time it takes to refill, a missing bucket is the same as a full one
+            ttl = (limit.count - tokens) / rate + 1
+            if await self.backend.compare_and_set(shared_key, raw, f"{tokens}:{now}".encode(), ttl):
+                return 0.0
+
+
+storage: RateLimitStorage = load_backend(settings.rate_limit_storage) or MemoryStorage()
+
+
+def client_key(scope) -> str:
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{oauth2.verify_access_token(token, oauth2.invalid_credentials()).id}"
+        except HTTPException:
+            pass  # Rejected by the route anyway, limited like an anonymous request meanwhile
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, storage: RateLimitStorage):
+        self.app = app
+        self.storage = storage
+        self.in_flight = 0
+        metrics.on_collect(lambda: IN_FLIGHT.set(self.in_flight))
+
+    def overloaded(self) -> bool:
+        if settings.shed_max_in_flight and self.in_flight > settings.shed_max_in_flight:
+            return True
+        return bool(settings.shed_pool_wait_ms) and recent_pool_wait.value() * 1000 > settings.shed_pool_wait_ms
+
+    async def refusal(self, scope, bucket: str, limit: Optional[Limit]) -> Optional[ORJSONResponse]:
+        # Shedding comes first so that it doesn't take the tokens of the requests it refuses
+        if self.overloaded():
+            SHED.inc(limit=bucket)
+            return ORJSONResponse(
+                {"detail": "The server is overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(settings.shed_retry_after)},
+            )
+        if limit is None:
+            return None
+        wait = await self.storage.take(f"{bucket}:{client_key(scope)}", limit)
+        if not wait:
+            return None
+        RATE_LIMITED.inc(limit=bucket)
+        return ORJSONResponse(
+            {"detail": "Too many requests"}, status_code=429, headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        self.in_flight += 1
+        try:
+            rule = RULES.get((scope["method"], scope["path"].rstrip("/")))
+            response = await self.refusal(scope, *rule) if rule is not None else None
+            if response is not None:
+                return await response(scope, receive, send)
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
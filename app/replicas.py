@@ -0,0 +1,195 @@
+"""Read replicas serving the read only routes, while the users who just wrote read from the primary
+
+get_read_db yields a session on the next healthy replica, round robin, or on the primary: when no
+replica is configured or healthy, and for settings.replica_stickiness_seconds after the user wrote
+(see ReplicaSet.stick), since the replicas may not have replayed the write yet. A replica is healthy
+while its health check connects and finds it lagging less than settings.replica_max_lag_seconds.
+
+Without a shared cache backend the stickiness is per worker, like the caches. The responses read
+from a replica aren't stored by the response caches, which only keep those of the primary.
+"""
+import asyncio
+import itertools
+import logging
+import os
+from typing import List, Optional, Union
+
+from fastapi import Depends, Request
+from jose import JWTError, jwt
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from . import metrics
+from .cache import CacheBackend, TTLCache, shared_backend
+from .config import settings
+from .database import create_routes_engine, get_db, open_session
+
+
+logger = logging.getLogger(__name__)
+
+READ_SESSIONS = metrics.Counter(
+    "db_read_sessions_total", "Sessions opened by the read only routes", ["database"]
+)
+REPLICA_HEALTHY = metrics.Gauge("db_replica_healthy", "1 while the replica serves reads", ["replica"])
+
+# Seconds the replica is behind, 0 while it has replayed all it received or when it is no replica
+REPLICATION_LAG = text(
+    "SELECT CASE WHEN pg_is_in_recovery() AND pg_last_wal_receive_lsn() IS DISTINCT FROM pg_last_wal_replay_lsn() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+)
+
+
+class Replica:
+    def __init__(self, url: str, name: str, engine: Optional[Union[Engine, AsyncEngine]] = None):
+        self.url = url
+        self.name = name
+        self.healthy = True  # Until checked otherwise
+        self._engine = engine
+
+    @property
+    def engine(self) -> Union[Engine, AsyncEngine]:
+        if self._engine is None:
+            self._engine = create_routes_engine(self.url, self.name)
+        return self._engine
+
+    async def _lag(self) -> float:
+        db = open_session(self.engine)
+        try:
+            return await db.scalar(REPLICATION_LAG)
+        finally:
+            await db.close()
+
+    async def check(self, timeout: float = 5):
+        try:
+            lag = await asyncio.wait_for(self._lag(), timeout)
+        except Exception as e:
+            if self.healthy:
+                logger.warning("Replica %s failed its health check: %r", self.name, e)
+            self.healthy = False
+            return
+        self.healthy = lag <= settings.replica_max_lag_seconds
+
+    def dispose_after_fork(self):
+        if self._engine is not None:
+            engine = self._engine.sync_engine if isinstance(self._engine, AsyncEngine) else self._engine
+            engine.dispose(close=False)
+
+    async def dispose(self):
+        if isinstance(self._engine, AsyncEngine):
+            await self._engine.dispose()
+        elif self._engine is not None:
+            self._engine.dispose()
+        self._engine = None
+
+
+class ReplicaSet:
+    def __init__(self, replicas: List[Replica], stickiness: float, backend: Optional[CacheBackend] = None):
+        self.replicas = replicas
+        self.stickiness = stickiness
+        self.backend = backend
+        self._sticky_users = TTLCache("sticky_users", 100_000, stickiness)
+        self._turn = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        metrics.on_collect(self._collect)
+
+    def _collect(self):
+        for replica in self.replicas:
+            REPLICA_HEALTHY.set(int(replica.healthy), replica=replica.name)
+
+    def choose(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    async def stick(self, user_id: int):
+        """Send the reads of the user to the primary for a while, to call after each of its writes"""
+        if not self.replicas:
+            return
+        self._sticky_users.set(user_id, True)
+        if self.backend is not None:
+            await self.backend.set(f"sticky_users:{user_id}", b"1", self.stickiness)
+
+    async def is_sticky(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        if self._sticky_users.get(user_id):
+            return True
+        return self.backend is not None and await self.backend.get(f"sticky_users:{user_id}") is not None
+
+    async def check(self):
+        await asyncio.gather(*(replica.check(settings.replica_health_interval) for replica in self.replicas))
+
+    async def check_forever(self, interval: float):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float):
+        if self.replicas:
+            self._task = asyncio.get_running_loop().create_task(self.check_forever(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+
+replica_set = ReplicaSet(
+    [
+        Replica(url.strip(), f"replica{i}")
+        for i, url in enumerate(settings.database_replica_urls.split(","))
+        if url.strip()
+    ],
+    settings.replica_stickiness_seconds,
+    shared_backend,
+)
+
+
+def _dispose_replica_engines_after_fork():
+    for replica in replica_set.replicas:
+        replica.dispose_after_fork()
+
+
+os.register_at_fork(after_in_child=_dispose_replica_engines_after_fork)
+
+
+def token_user_id(request: Request) -> Optional[int]:
+    # Not verified: it only decides where the reads go, the routes still authenticate the request
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return int(jwt.get_unverified_claims(token)["user_id"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        return None
+
+
+async def get_read_db(request: Request, db: AsyncSession = Depends(get_db)):
+    """The session of the read only routes, on a replica when possible. db is the primary's"""
+    if not replica_set.replicas:
+        yield db
+        return
+    replica = None
+    if await replica_set.is_sticky(token_user_id(request)):
+        request.state.skip_cache = True
+    else:
+        replica = replica_set.choose()
+    if replica is None:
+        READ_SESSIONS.inc(database="primary")
+        yield db
+        return
+    READ_SESSIONS.inc(database=replica.name)
+    request.state.read_replica = replica.name
+    read_db = open_session(replica.engine)
+    try:
+        yield read_db
+    finally:
+        await read_db.close()
@@ -0,0 +1,88 @@
+"""Revoked tokens, checked in memory by each worker and recorded in the revoked_tokens table
+
+A revoked access token stops mattering when it expires, at most the access token lifetime after
+being revoked, so the RevocationList of a worker only holds the revocations of that window. It
+reloads them from the table every few seconds: the other workers' revocations take up to that
+long to be enforced, its own are immediately.
+"""
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from . import models
+from .database import session_scope
+
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    """Ids of the tokens and token families revoked in the last window seconds"""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._revoked: Set[str] = set()
+        # Revoked by this worker, kept until a sync is sure to have seen them
+        self._recent: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, token_id: Optional[str]) -> bool:
+        return token_id in self._revoked
+
+    def add(self, token_id: str):
+        with self._lock:
+            self._recent[token_id] = time.monotonic()
+            self._revoked.add(token_id)
+
+    async def revoke(self, db, token_id: str, expires_at: datetime) -> bool:
+        """Record the revocation until expires_at and commit it, False if it was already revoked"""
+        result = await db.execute(
+            insert(models.RevokedToken)
+            .values(jti=token_id, expires_at=expires_at)
+            .on_conflict_do_nothing()
+            .returning(models.RevokedToken.jti)
+        )
+        revoked = result.first() is not None
+        await db.commit()
+        self.add(token_id)
+        return revoked
+
+    async def sync(self, db):
+        result = await db.execute(
+            select(models.RevokedToken.jti).where(
+                models.RevokedToken.revoked_at > func.now() - timedelta(seconds=self.window)
+            )
+        )
+        revoked = set(result.scalars())
+        with self._lock:
+            forget_before = time.monotonic() - self.window
+            self._recent = {token_id: at for token_id, at in self._recent.items() if at > forget_before}
+            self._revoked = revoked | self._recent.keys()
+
+    async def sync_forever(self, interval: float):
+        while True:
+            try:
+                async with session_scope() as db:
+                    await self.sync(db)
+            except Exception:
+                logger.exception("Couldn't load the revoked tokens")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float):
+        self._task = asyncio.get_running_loop().create_task(self.sync_forever(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
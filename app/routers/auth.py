@@ -1,4 +1,7 @@
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from fastapi import APIRouter, Depends, status, HTTPException
 
@@ -10,12 +13,53 @@ router = APIRouter(tags=["Authentication"])
 
 
 @router.post("/login", response_model=schemas.Token)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     # OAuthPasswordRequestForm only has username and password
-    user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
-    if not user or not utils.verify(user_credentials.password, user.password):
+    result = await db.execute(select(models.User).where(models.User.email == user_credentials.username))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid credentials")
+    valid, new_hash = await utils.verify_and_update_async(user_credentials.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid credentials")
+    if new_hash:  # Hashed with other bcrypt rounds than the current ones
+        user.password = new_hash
+        await db.commit()
+
+    return oauth2.create_tokens(user.id)
+
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_token(body: schemas.TokenRefresh, db: AsyncSession = Depends(get_db)):
+    # Spares the clients logging in again, and a bcrypt verification, each time the access token expires
+    credentials_exception = oauth2.invalid_credentials()
+    token = oauth2.verify_refresh_token(body.refresh_token, credentials_exception)
+    family_revoked = await db.scalar(select(models.RevokedToken.jti).where(models.RevokedToken.jti == token["fam"]))
+    if family_revoked:
+        raise credentials_exception
+    # Each refresh token is used once: revoking it as it is rotated tells a replay apart, which
+    # means it leaked, so the whole family is revoked then
+    expires_at = datetime.fromtimestamp(token["exp"], timezone.utc)
+    if not await oauth2.revocation_list.revoke(db, token["jti"], expires_at):
+        await revoke_family(db, token["fam"])
+        raise credentials_exception
+    # A deleted user's new access token is rejected by get_current_user
+    return oauth2.create_tokens(token["user_id"], token["fam"])
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    token: str = Depends(oauth2.oauth2_scheme),
+    user: schemas.UserResponse = Depends(oauth2.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Revokes the refresh token along with the access token
+    token_data = oauth2.verify_access_token(token, oauth2.invalid_credentials())
+    await revoke_family(db, token_data.family)
+
 
-    access_token = oauth2.create_access_token(data={"user_id": user.id})
-    return {"access_token": access_token, "token_type": "bearer"}
+async def revoke_family(db: AsyncSession, family: str):
+    # Outlives the refresh tokens of the family, whenever they were issued
+    expires_at = datetime.now(timezone.utc) + timedelta(days=oauth2.REFRESH_TOKEN_EXPIRE_DAYS)
+    await oauth2.revocation_list.revoke(db, family, expires_at)
 
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from .. import metrics
+
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Only reports the worker which serves the request, its samples carry its pid
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,132 +1,326 @@
-from typing import List
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from typing import Iterable, List, Optional, Union
+from sqlalchemy import func, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
-from .. import models, schemas, oauth2
+from .. import bulk, database, models, schemas, oauth2, pagination, ranking, serialization, search as post_search
+from ..cache import ResponseCache, shared_backend
+from ..config import settings
 from ..database import get_db
-from fastapi import HTTPException, status, Depends, APIRouter
+from ..replicas import get_read_db, replica_set
+from fastapi import BackgroundTasks, Header, HTTPException, Request, status, Depends, APIRouter
+from fastapi.responses import StreamingResponse
 
 
 router = APIRouter(prefix="/posts", tags=["Posts"])
 
+# The read routes serve the same pages over and over between writes. Whatever changes a post
+# or its votes has to invalidate it
+post_cache = ResponseCache(
+    "posts", settings.response_cache_size, settings.response_cache_ttl, shared_backend
+)
 
-@router.get("/", response_model=List[schemas.PostWithVotes])
-def get_posts(
-    db: Session = Depends(get_db),
+FEED_COLUMNS = serialization.columns_of(models.Post, schemas.PostWithVotes)
+
+# The deleted posts stay in the table until purged, every read has to skip them
+LIVE = models.Post.deleted_at.is_(None)
+
+
+async def refresh_rankings(post_ids: Iterable[int]):
+    """The background task of the writes, once they invalidated post_cache"""
+    # A session of its own: the request's may be closed by now, and would hold its connection meanwhile
+    async with database.session_scope() as db:
+        await ranking.refresh_rankings(db, post_ids)
+    # A sort=hot|top page read between the write and now was cached with the former rankings
+    await post_cache.invalidate()
+
+
+@router.get(
+    "/", response_model=Union[List[schemas.PostWithVotes], schemas.PostPage]
+)
+async def get_posts(
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
     limit: int = 10,
     skip: int = 0,
     search: str = "",
+    cursor: Optional[str] = None,
+    sort: Optional[schemas.PostSort] = None,
 ):
-    query_posts = db.query(
-        models.Post, func.count(models.Vote.post_id).label("votes")
-    ).filter(models.Post.title.contains(search))
-    join_with_votes = query_posts.join(
-        models.Vote, models.Post.id == models.Vote.post_id, isouter=True
+    if cursor is not None and sort not in (None, schemas.PostSort.new):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursors only page through the newest posts, use skip to page a ranked feed",
+        )
+    cache_key, cached_response = await post_cache.lookup(request)
+    if cached_response:
+        return cached_response
+    # Votes are read from the denormalized posts.vote_count, no join with votes needed.
+    # Only the columns of the response are selected, and serialized without pydantic
+    select_posts = post_search.search_posts(
+        db.bind.dialect.name, select(*FEED_COLUMNS).where(LIVE), search, ranked=cursor is None and sort is None
     )
-    groupby_post = join_with_votes.group_by(models.Post.id)
-    # NOTE If you want to have a User in the response, skip the subquery and change the response schema
-    return db.query(groupby_post.limit(limit).offset(skip).subquery()).all()
+    if cursor is None:
+        # Offset pagination, kept for the clients that don't send a cursor
+        select_posts = ranking.order_feed(select_posts, sort)
+        result = await db.execute(select_posts.limit(limit).offset(skip))
+        return await post_cache.store_body(
+            request, cache_key, serialization.dump_rows(result.all())
+        )
+
+    # Keyset pagination, newest first even when searching. An empty cursor asks for the first page
+    select_posts = select_posts.order_by(
+        models.Post.created_at.desc(), models.Post.id.desc()
+    )
+    if cursor:
+        try:
+            created_at, post_id = pagination.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+        select_posts = select_posts.where(
+            tuple_(models.Post.created_at, models.Post.id) < (created_at, post_id)
+        )
+    result = await db.execute(select_posts.limit(limit + 1))  # The extra row tells if there is a next page
+    posts = result.all()
+    page = posts[:limit]
+    next_cursor = (
+        pagination.encode_cursor(page[-1]) if page and len(posts) > limit else None
+    )
+    body = serialization.dumps(
+        {"items": serialization.rows_to_dicts(page), "next_cursor": next_cursor}
+    )
+    return await post_cache.store_body(request, cache_key, body)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_posts(
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserResponse = Depends(oauth2.get_current_user),
+    search: str = "",
+):
+    """Every post matching search as NDJSON, one PostWithVotes per line.
+
+    The rows come from a server side cursor and are written a chunk at a time, each chunk waiting
+    for the client to take the previous one, so the memory used doesn't depend on the row count.
+    """
+    select_posts = post_search.search_posts(
+        db.bind.dialect.name, select(*FEED_COLUMNS).where(LIVE), search, ranked=False
+    ).order_by(models.Post.id)
+    result = await db.stream(select_posts)
+
+    async def lines():
+        async for rows in result.partitions(settings.export_chunk_size):
+            yield b"".join(serialization.dumps(dict(row._mapping)) + b"\n" for row in rows)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 # TODO Figure out when to use detail and when to use data
 @router.get("/latest", response_model=schemas.Post)
-def get_latest_post(
-    db: Session = Depends(get_db),
+async def get_latest_post(
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
 ):  # This could also be a fastapi.Body
-    max_id = db.query(func.max(models.Post.id)).first()[0]
-    post = db.query(models.Post).filter(models.Post.id == max_id).first()
+    cache_key, cached_response = await post_cache.lookup(request)
+    if cached_response:
+        return cached_response
+    # A single statement walking ix_posts_created_at_id backwards, with the owner joined in
+    result = await db.execute(
+        select(models.Post)
+        .options(joinedload(models.Post.owner))
+        .where(LIVE)
+        .order_by(models.Post.created_at.desc(), models.Post.id.desc())
+        .limit(1)
+    )
+    post = result.scalars().first()
     if not post:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {id} was not found",
+            status_code=status.HTTP_404_NOT_FOUND, detail="There are no posts yet"
         )
-    return post
+    return await post_cache.store(request, cache_key, schemas.Post, post)
 
 
 @router.get(
     "/{id}", response_model=schemas.PostWithVotes
 )  # path parameter, this has to be the last defined GET on posts/sthg
-def get_post(
+async def get_post(
     id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
 ):
-    query_posts = db.query(
-        models.Post, func.count(models.Vote.post_id).label("votes")
-    ).filter(models.Post.id == id)
-    join_with_votes = query_posts.join(
-        models.Vote, models.Post.id == models.Vote.post_id, isouter=True
-    )
-    groupby_post = join_with_votes.group_by(models.Post.id)
-    post = db.query(groupby_post.subquery()).first()
-    if not post:
+    cache_key, cached_response = await post_cache.lookup(request)
+    if cached_response:
+        return cached_response
+    post = await db.get(models.Post, id)
+    if not post or post.deleted_at is not None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Post with id {id} was not found",
         )
-    return post
+    return await post_cache.store(request, cache_key, schemas.PostWithVotes, post, etag_prefix(post))
 
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Post)
-def create_post(
+async def create_post(
     post: schemas.PostCreate,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
 ):
-    new_post = models.Post(
-        **dict(post), user_id=user.id
-    )  # TODO Give Post all the fields
-    db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
-    return new_post
+    # The INSERT returns the columns set by the database, and the owner is the current user
+    result = await db.execute(
+        insert(models.Post)
+        .values(**dict(post), user_id=user.id)  # TODO Give Post all the fields
+        .returning(*models.Post.__table__.columns)
+    )
+    new_post = result.mappings().one()
+    await db.commit()
+    await post_cache.invalidate()
+    await replica_set.stick(user.id)
+    background_tasks.add_task(refresh_rankings, [new_post["id"]])
+    return {**new_post, "owner": user}
 
 
-@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(
-    id: int,
-    db: Session = Depends(get_db),
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=schemas.BulkPostsCreated)
+async def create_posts_bulk(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
 ):
-    query_deleted_post = db.query(models.Post).filter(models.Post.id == id)
-    deleted_post = query_deleted_post.first()
-    if not deleted_post:
+    """Create many PostCreate at once, sent as a JSON array or as NDJSON (Content-Type application/x-ndjson).
+
+    They are loaded with COPY a chunk at a time, all in one transaction: if a post is invalid, none
+    is created.
+    """
+    ids, chunk = [], []
+    async for post in bulk.read_posts(request):
+        chunk.append(post)
+        if len(chunk) == settings.bulk_chunk_size:
+            ids += await bulk.copy_posts(db, user.id, chunk)
+            chunk = []
+    if chunk:
+        ids += await bulk.copy_posts(db, user.id, chunk)
+    await db.commit()
+    if ids:
+        await post_cache.invalidate()
+        await replica_set.stick(user.id)
+        for start in range(0, len(ids), settings.bulk_chunk_size):
+            background_tasks.add_task(refresh_rankings, ids[start:start + settings.bulk_chunk_size])
+    return {"ids": ids}
+
+
+def etag_prefix(post: models.Post) -> str:
+    # The ETag of GET /posts/{id} is "<id>-<version>-<digest of the body>": the writes only compare
+    # the version, a vote changes the body but doesn't conflict with them
+    return f"{post.id}-{post.version}-"
+
+
+def if_match_versions(id: int, if_match: Optional[str] = Header(None)) -> Optional[List[int]]:
+    """The versions of the post If-Match allows the write on, None for any"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag_id, _, rest = tag.strip().removeprefix("W/").strip('"').partition("-")
+        version, _, _ = rest.partition("-")
+        if tag_id == str(id) and version.isdigit():
+            versions.append(int(version))
+    return versions  # Empty if none is a version of the post, which it doesn't match
+
+
+async def raise_write_miss(db: AsyncSession, id: int, user: schemas.UserResponse):
+    # The write matched no row: find out why, only now that it failed
+    result = await db.execute(select(models.Post.user_id).where(models.Post.id == id, LIVE))
+    owner_id = result.scalar()
+    if owner_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Post with id {id} was not found",
         )
-    if deleted_post.user_id != user.id:
+    if owner_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to perform this operation",
         )
-    query_deleted_post.delete(synchronize_session=False)
-    db.commit()
+    raise HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="The post was changed since, fetch its new version",
+    )
+
+
+def write_conditions(id: int, user: schemas.UserResponse, versions: Optional[List[int]]) -> list:
+    conditions = [models.Post.id == id, models.Post.user_id == user.id, LIVE]
+    if versions is not None:
+        conditions.append(models.Post.version.in_(versions))
+    return conditions
+
+
+@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_post(
+    id: int,
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserResponse = Depends(oauth2.get_current_user),
+    versions: Optional[List[int]] = Depends(if_match_versions),
+):
+    # Only marks the post, the purge deletes it and its votes later, a batch at a time
+    result = await db.execute(
+        update(models.Post)
+        .where(*write_conditions(id, user, versions))
+        .values(deleted_at=func.now())
+        .returning(models.Post.id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.first() is None:
+        await raise_write_miss(db, id, user)
+    await db.commit()
+    await post_cache.invalidate()
+    await replica_set.stick(user.id)
+
+
+async def write_post(
+    db: AsyncSession, id: int, user: schemas.UserResponse, versions: Optional[List[int]], values: dict
+) -> dict:
+    # A single UPDATE checks the owner and the version, without locking the row beforehand
+    result = await db.execute(
+        update(models.Post)
+        .where(*write_conditions(id, user, versions))
+        .values(**values, version=models.Post.version + 1)
+        .returning(*models.Post.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )
+    updated_post = result.mappings().first()
+    if updated_post is None:
+        await raise_write_miss(db, id, user)
+    await db.commit()
+    await post_cache.invalidate()
+    await replica_set.stick(user.id)
+    return {**updated_post, "owner": user}
 
 
-# TODO Figure out how to update a post without having to re implement all its fields
 @router.put("/{id}", status_code=status.HTTP_200_OK, response_model=schemas.Post)
-def update_post(
+async def update_post(
     id: int,
     post: schemas.PostCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
+    versions: Optional[List[int]] = Depends(if_match_versions),
 ):
-    query_updated_post = db.query(models.Post).filter(models.Post.id == id)
-    updated_post = query_updated_post.first()
-    if not updated_post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {id} was not found",
-        )
-    if updated_post.user_id != user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to perform this operation",
-        )
-    query_updated_post.update(dict(post), synchronize_session=False)
-    db.commit()
-    return query_updated_post.first()
+    return await write_post(db, id, user, versions, dict(post))
+
+
+@router.patch("/{id}", status_code=status.HTTP_200_OK, response_model=schemas.Post)
+async def patch_post(
+    id: int,
+    post: schemas.PostUpdate,
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserResponse = Depends(oauth2.get_current_user),
+    versions: Optional[List[int]] = Depends(if_match_versions),
+):
+    return await write_post(db, id, user, versions, post.dict(exclude_unset=True))
@@ -1,27 +1,29 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status, Depends, APIRouter
 
 from .. import models, schemas
 from ..database import get_db
-from app.utils import hash_pw
+from ..replicas import get_read_db, replica_set
+from app.utils import hash_pw_async
 
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    user.password = hash_pw(user.password)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    user.password = await hash_pw_async(user.password)
     new_user = models.User(**dict(user))  # TODO Give user all the fields
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    await replica_set.stick(new_user.id)
     return new_user
 
 
 @router.get("/{id}", response_model=schemas.UserResponse)
-def get_user(id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == id).first()
+async def get_user(id: int, db: AsyncSession = Depends(get_read_db)):
+    user = await db.get(models.User, id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {id} was not found")
-    return user
\ No newline at end of file
+    return user
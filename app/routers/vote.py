@@ -1,46 +1,168 @@
-from fastapi import APIRouter, HTTPException, status, Depends, APIRouter
-from sqlalchemy.orm import Session
+from typing import List
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Depends, APIRouter
+from pydantic import conlist
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import models, schemas, oauth2
 from ..database import get_db
+from ..replicas import replica_set
+from .post import LIVE, post_cache, refresh_rankings
 
 
 router = APIRouter(prefix="/votes", tags=["Votes"])
 
+MAX_BATCH_SIZE = 1000
+
+
+async def increment_vote_count(db: AsyncSession, post_id: int, delta: int):
+    """Raise a 404, rolling the vote back, if the post was deleted"""
+    # Done in SQL so concurrent votes on the same post can't overwrite each other's count
+    result = await db.execute(
+        update(models.Post)
+        .where(models.Post.id == post_id, LIVE)
+        .values(vote_count=models.Post.vote_count + delta)
+        .returning(models.Post.id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.first() is None:
+        await db.rollback()
+        raise post_not_found(post_id)
+
+
+async def raise_if_deleted(db: AsyncSession, post_id: int):
+    # The vote changed nothing: tell a missing or deleted post apart, only now that it failed
+    post = await db.get(models.Post, post_id)
+    if not post or post.deleted_at is not None:
+        raise post_not_found(post_id)
+
+
+def post_not_found(post_id: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Post with id {post_id} was not found",
+    )
+
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def vote(
+async def vote(
     vote: schemas.Vote,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
     user: schemas.UserResponse = Depends(oauth2.get_current_user),
 ):
-    post = db.query(models.Post).filter(models.Post.id == vote.post_id).first()
-    if not post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {vote.post_id} was not found",
-        )
-    vote_query = db.query(models.Vote).filter(
-        models.Vote.user_id == user.id, models.Vote.post_id == vote.post_id
-    )
-    found_vote = vote_query.first()
+    # The vote is written by a single statement, which tells whether it changed anything:
+    # two concurrent identical votes can't both go through
     if vote.dir == 1:
-        if found_vote:
+        try:
+            result = await db.execute(
+                insert(models.Vote)
+                .values(post_id=vote.post_id, user_id=user.id)
+                .on_conflict_do_nothing()
+                .returning(models.Vote.post_id)
+            )
+        except IntegrityError:  # The foreign key on posts
+            await db.rollback()
+            raise post_not_found(vote.post_id)
+        if result.first() is None:
+            # The votes of a deleted post stay until it is purged
+            await raise_if_deleted(db, vote.post_id)
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"User {user.id} has already upvoted post {vote.post_id}",
             )
-        new_vote = models.Vote(post_id=vote.post_id, user_id=user.id)
-        db.add(new_vote)
-        db.commit()
+        await increment_vote_count(db, vote.post_id, 1)
+        await db.commit()
+        await post_cache.invalidate()  # The responses carry the vote counts
+        await replica_set.stick(user.id)
+        background_tasks.add_task(refresh_rankings, [vote.post_id])
         return {"message": "Successfully upvoted post"}
 
     else:
-        if not found_vote:
+        result = await db.execute(
+            delete(models.Vote)
+            .where(models.Vote.user_id == user.id, models.Vote.post_id == vote.post_id)
+            .returning(models.Vote.post_id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.first() is None:
+            await raise_if_deleted(db, vote.post_id)
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"User {user.id} has not upvoted post {vote.post_id}",
             )
-        vote_query.delete(synchronize_session=False)
-        db.commit()
+        await increment_vote_count(db, vote.post_id, -1)
+        await db.commit()
+        await post_cache.invalidate()
+        await replica_set.stick(user.id)
+        background_tasks.add_task(refresh_rankings, [vote.post_id])
         return {"message": "Successfully removed upvote"}
+
+
+@router.post("/batch", response_model=List[schemas.VoteResult])
+async def vote_batch(
+    votes: conlist(schemas.Vote, min_items=1, max_items=MAX_BATCH_SIZE),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserResponse = Depends(oauth2.get_current_user),
+):
+    """Apply many votes in a few statements, answering for each one what POST /votes would have"""
+    post_ids = [vote.post_id for vote in votes]
+    if len(set(post_ids)) != len(post_ids):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="A post can only be voted once per batch",
+        )
+    result = await db.execute(select(models.Post.id).where(models.Post.id.in_(post_ids), LIVE))
+    existing = set(result.scalars().all())
+    upvotes = [vote.post_id for vote in votes if vote.dir == 1 and vote.post_id in existing]
+    removals = [vote.post_id for vote in votes if vote.dir == 0 and vote.post_id in existing]
+
+    upvoted, removed = set(), set()
+    if upvotes:
+        result = await db.execute(
+            insert(models.Vote)
+            .values([{"post_id": post_id, "user_id": user.id} for post_id in upvotes])
+            .on_conflict_do_nothing()
+            .returning(models.Vote.post_id)
+        )
+        upvoted = set(result.scalars().all())
+    if removals:
+        result = await db.execute(
+            delete(models.Vote)
+            .where(models.Vote.user_id == user.id, models.Vote.post_id.in_(removals))
+            .returning(models.Vote.post_id)
+            .execution_options(synchronize_session=False)
+        )
+        removed = set(result.scalars().all())
+    if upvoted or removed:
+        await db.execute(
+            update(models.Post)
+            .where(models.Post.id.in_(upvoted | removed))
+            .values(vote_count=models.Post.vote_count + case((models.Post.id.in_(upvoted), 1), else_=-1))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        await post_cache.invalidate()
+        await replica_set.stick(user.id)
+        background_tasks.add_task(refresh_rankings, upvoted | removed)
+
+    results = []
+    for vote in votes:
+        if vote.post_id not in existing:
+            status_code, detail = status.HTTP_404_NOT_FOUND, f"Post with id {vote.post_id} was not found"
+        elif vote.post_id in upvoted:
+            status_code, detail = status.HTTP_201_CREATED, "Successfully upvoted post"
+        elif vote.post_id in removed:
+            status_code, detail = status.HTTP_201_CREATED, "Successfully removed upvote"
+        elif vote.dir == 1:
+            status_code, detail = status.HTTP_409_CONFLICT, f"User {user.id} has already upvoted post {vote.post_id}"
+        else:
+            status_code, detail = status.HTTP_409_CONFLICT, f"User {user.id} has not upvoted post {vote.post_id}"
+        results.append(
+            schemas.VoteResult(post_id=vote.post_id, dir=vote.dir, status_code=status_code, detail=detail)
+        )
+    return results
@@ -1,4 +1,5 @@
-from typing import Optional
+from enum import Enum
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr, ValidationError, validator
 from datetime import datetime
 
@@ -33,26 +34,59 @@ class PostCreate(PostBase):
     pass
 
 
+class BulkPostsCreated(BaseModel):
+    ids: List[int]  # In the order of the posts sent
+
+
+class PostUpdate(BaseModel):
+    """The fields of a PATCH, those left out keep their value"""
+
+    title: Optional[str]
+    content: Optional[str]
+    published: Optional[bool]
+
+    @validator("title", "content", "published")
+    def not_null(cls, v):
+        if v is None:
+            raise ValueError("may be left out, not null")
+        return v
+
+
 class Post(PostBase):
     id: int
     user_id: int
     created_at: datetime
+    # The ETag of GET /posts/{id} starts with "<id>-<version>". Sent back in If-Match, the post is
+    # updated or deleted only if nobody did meanwhile
+    version: int
     owner: UserResponse
 
     class Config:
         orm_mode = True
 
 
+class PostSort(str, Enum):
+    new = "new"
+    top = "top"  # Most votes first
+    hot = "hot"  # Votes weighed against age, see app/ranking.py
+
+
 class PostWithVotes(PostBase):
     id: int
     user_id: int
     created_at: datetime
+    version: int
     votes: int
 
     class Config:
         orm_mode = True
 
 
+class PostPage(BaseModel):
+    items: List[PostWithVotes]
+    next_cursor: Optional[str] = None  # None on the last page
+
+
 class Vote(BaseModel):
     post_id: int
     dir: int
@@ -64,10 +98,24 @@ class Vote(BaseModel):
         raise ValidationError(f"dir is supposed to be 0 or 1, got {v}")
 
 
+class VoteResult(BaseModel):
+    post_id: int
+    dir: int
+    status_code: int  # What POST /votes would have answered for this vote alone
+    detail: str
+
+
 class Token(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
 
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+
 class TokenData(BaseModel):
     id: Optional[str] = None
+    jti: Optional[str] = None
+    family: Optional[str] = None
@@ -0,0 +1,86 @@
+"""Full text search over the title and content of the posts
+
+Postgres matches against the generated posts.search_vector column and its GIN index. SQLite
+(used as a stand-in when no Postgres server is around) gets an FTS5 table kept in sync by
+triggers. Both are created along with the posts table by metadata.create_all, and by the
+alembic migrations for Postgres.
+"""
+from sqlalchemy import DDL, column, event, func, literal_column, table
+from sqlalchemy.sql import Select
+
+from . import models
+
+
+TEXT_SEARCH_CONFIG = "english"
+
+posts = models.Post.__table__
+posts_fts = table("posts_fts", column("rowid"), column("rank"))
+
+_postgres_ddl = [
+    DDL(
+        "ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        f"(to_tsvector('{TEXT_SEARCH_CONFIG}', title || ' ' || content)) STORED"
+    ),
+    DDL("CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector)"),
+]
+_sqlite_ddl = [
+    DDL(
+        "CREATE VIRTUAL TABLE posts_fts USING fts5"
+        "(title, content, content='posts', content_rowid='id')"
+    ),
+    DDL(
+        "CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN "
+        "INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+        "END"
+    ),
+    DDL(
+        "CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN "
+        "INSERT INTO posts_fts(posts_fts, rowid, title, content) "
+        "VALUES ('delete', old.id, old.title, old.content); "
+        "END"
+    ),
+    DDL(
+        "CREATE TRIGGER posts_fts_update AFTER UPDATE ON posts BEGIN "
+        "INSERT INTO posts_fts(posts_fts, rowid, title, content) "
+        "VALUES ('delete', old.id, old.title, old.content); "
+        "INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+        "END"
+    ),
+]
+for ddl in _postgres_ddl:
+    event.listen(posts, "after_create", ddl.execute_if(dialect="postgresql"))
+for ddl in _sqlite_ddl:
+    event.listen(posts, "after_create", ddl.execute_if(dialect="sqlite"))
+event.listen(
+    posts, "before_drop", DDL("DROP TABLE IF EXISTS posts_fts").execute_if(dialect="sqlite")
+)
+
+
+def _sqlite_match_query(search: str) -> str:
+    # Quote every word so FTS5 doesn't interpret the user input as query syntax
+    return " ".join('"' + word.replace('"', '""') + '"' for word in search.split())
+
+
+def search_posts(dialect: str, query: Select, search: str, ranked: bool = True) -> Select:
+    """Restrict a select of models.Post to the posts matching search, best matches first if ranked"""
+    if not search.strip():
+        return query  # Nothing to match, leave the planner a plain scan of posts
+    if dialect == "postgresql":
+        search_vector = literal_column("posts.search_vector")
+        # Rendered inline, asyncpg would otherwise bind the config as text and miss the regconfig overload
+        config = literal_column(f"'{TEXT_SEARCH_CONFIG}'::regconfig")
+        ts_query = func.websearch_to_tsquery(config, search)
+        query = query.filter(search_vector.op("@@")(ts_query))
+        if ranked:
+            query = query.order_by(func.ts_rank(search_vector, ts_query).desc())
+        return query
+    if dialect == "sqlite":
+        query = query.join(posts_fts, posts_fts.c.rowid == models.Post.id).filter(
+            literal_column("posts_fts").op("MATCH")(_sqlite_match_query(search))
+        )
+        if ranked:
+            query = query.order_by(posts_fts.c.rank)  # bm25, lower is better
+        return query
+    return query.filter(
+        models.Post.title.contains(search) | models.Post.content.contains(search)
+    )
@@ -0,0 +1,41 @@
+"""JSON serialization of the responses with orjson
+
+dump_model validates the content against its response model like FastAPI would. The feed goes
+through dump_rows instead: it selects exactly the columns of its schema (see columns_of), so the
+rows are serialized as they come, without building and validating a pydantic model per post.
+A NULL in a nullable column is replaced by the default of its field in SQL, as pydantic would.
+"""
+from typing import Any, List, Sequence, Type
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, parse_obj_as
+from sqlalchemy import func
+from sqlalchemy.engine import Row
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content)
+
+
+def dump_model(response_type: Any, content: Any) -> bytes:
+    return dumps(jsonable_encoder(parse_obj_as(response_type, content)))
+
+
+def columns_of(model, schema: Type[BaseModel]) -> List:
+    """The attributes of the model labelled like the fields of the schema, to select rows for dump_rows"""
+    columns = []
+    for name, field in schema.__fields__.items():
+        column = getattr(model, name)
+        if getattr(column.expression, "nullable", False) and field.default is not None:
+            column = func.coalesce(column, field.default)
+        columns.append(column.label(name))
+    return columns
+
+
+def rows_to_dicts(rows: Sequence[Row]) -> List[dict]:
+    return [dict(row._mapping) for row in rows]
+
+
+def dump_rows(rows: Sequence[Row]) -> bytes:
+    return dumps(rows_to_dicts(rows))
@@ -1,7 +1,19 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with other rounds than settings.bcrypt_rounds are reported by needs_update
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+_hash_executor: Optional[ProcessPoolExecutor] = None
 
 
 def hash_pw(password: str):
@@ -9,4 +21,44 @@ def hash_pw(password: str):
 
 
 def verify(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify the password, and hash it again if hashed_password doesn't follow pwd_context anymore"""
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(plain_password)
+    return True, None
+
+
+async def _run_hashing(fn, *args):
+    # bcrypt is CPU bound: in the threadpool it would compete with the request threads for the GIL,
+    # the process pool spreads it over the cores instead
+    global _hash_executor
+    if settings.password_hash_workers == 0:
+        return await run_in_threadpool(fn, *args)
+    if _hash_executor is None:
+        # Forking this worker, with its event loop and threads, could copy locks held by the other
+        # threads into the children. The forkserver starts them from a clean process instead
+        _hash_executor = ProcessPoolExecutor(
+            max_workers=settings.password_hash_workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+
+
+async def hash_pw_async(password: str) -> str:
+    return await _run_hashing(hash_pw, password)
+
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_hashing(verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_hash_executor():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown()
+        _hash_executor = None
@@ -0,0 +1,6 @@
+import os
+
+# The benchmarks hammer the rate limited routes from a single address: don't limit them unless the
+# environment says otherwise. Set before app.config reads it, the servers started inherit it too
+os.environ.setdefault("RATE_LIMIT_AUTH", "")
+os.environ.setdefault("RATE_LIMIT_WRITES", "")
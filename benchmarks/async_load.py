@@ -0,0 +1,26 @@
+"""Requests per second of the sync and async database modes against the same database
+
+Starts a uvicorn server per mode (ASYNC_DATABASE=false/true) and hammers it with concurrent clients:
+
+    python -m benchmarks.async_load --concurrency 64 --duration 20
+"""
+from app import models
+
+from .common import auth_headers, bench_user, compare_servers, seed_posts, server_parser
+
+
+def main():
+    parser = server_parser(__doc__)
+    parser.add_argument("--posts", type=int, default=1000)
+    args = parser.parse_args()
+
+    with bench_user("bench_async_load@bench.com") as (db, user):
+        seed_posts(db, user.id, args.posts)
+        post_ids = db.query(models.Post.id).filter(models.Post.user_id == user.id).limit(100)
+        paths = ["/posts/?limit=10"] + [f"/posts/{post_id}" for post_id, in post_ids]
+        modes = (("sync", {"ASYNC_DATABASE": "false"}), ("async", {"ASYNC_DATABASE": "true"}))
+        compare_servers(modes, args, paths, auth_headers(user))
+
+
+if __name__ == "__main__":
+    main()
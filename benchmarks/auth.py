@@ -0,0 +1,72 @@
+"""Cost of authenticating a request per token algorithm, with and without the verified token cache
+
+    python -m benchmarks.auth --repeat 10000
+
+Times oauth2.verify_access_token alone, which is all the authentication a request costs once its
+user is cached, and oauth2.create_access_token, which every login pays. No server is needed.
+"""
+import argparse
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from fastapi import HTTPException
+from jose import jwt
+
+from app import oauth2
+from app.config import settings
+
+from .common import summarize, time_calls
+
+
+def private_pem(private_key) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+ALGORITHMS = {
+    "HS256": lambda: "",
+    "ES256": lambda: private_pem(ec.generate_private_key(ec.SECP256R1())),
+    "EdDSA": lambda: private_pem(ed25519.Ed25519PrivateKey.generate()),
+    "RS256": lambda: private_pem(rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+}
+
+
+def print_stats(label: str, durations):
+    stats = summarize(durations)
+    print(f"{label:>24}: " + ", ".join(f"{k.removesuffix('_ms')}={v * 1000:.1f}us" for k, v in stats.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10_000)
+    args = parser.parse_args()
+
+    invalid = HTTPException(status_code=401)
+    # The key given as a string, as verify_access_token did before parsing it once
+    token = oauth2.create_access_token({"user_id": 1})
+    print_stats(
+        "HS256 decode (before)",
+        time_calls(lambda: jwt.decode(token, settings.secret_key, algorithms=["HS256"]), args.repeat),
+    )
+    for algorithm, private_key in ALGORITHMS.items():
+        oauth2.ALGORITHM = algorithm
+        oauth2.SIGNING_KEY, oauth2.VERIFYING_KEY = oauth2.load_keys(algorithm, settings.secret_key, private_key())
+        print_stats(
+            f"{algorithm} create", time_calls(lambda: oauth2.create_access_token({"user_id": 1}), args.repeat)
+        )
+        token = oauth2.create_access_token({"user_id": 1})
+
+        def verify():
+            oauth2.verified_tokens.clear()
+            oauth2.verify_access_token(token, invalid)
+
+        print_stats(f"{algorithm} verify", time_calls(verify, args.repeat))
+        print_stats(
+            f"{algorithm} verify (cached)",
+            time_calls(lambda: oauth2.verify_access_token(token, invalid), args.repeat),
+        )
+
+
+if __name__ == "__main__":
+    main()
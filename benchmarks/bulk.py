@@ -0,0 +1,80 @@
+"""Ingestion rate of POST /posts/bulk, as a JSON array and as NDJSON, against POST /posts one post at a time
+
+    python -m benchmarks.bulk --posts 20000 --single-posts 2000 --concurrency 8
+
+Runs against a uvicorn server on the configured database. The single posts are sent by --concurrency
+clients, each bulk request carries all --posts posts.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+import orjson
+
+from app.database import SessionLocal
+
+from .common import auth_headers, load, seed_user, serve
+
+
+def make_posts(count: int, prefix: str):
+    return [{"title": f"{prefix} title {i}", "content": f"{prefix} content {i} " * 10} for i in range(count)]
+
+
+def post_bulk(base_url: str, headers, body: bytes, content_type: str) -> int:
+    with httpx.Client(base_url=base_url, headers=headers, timeout=300) as client:
+        response = client.post("/posts/bulk", content=body, headers={"Content-Type": content_type})
+        response.raise_for_status()
+        return len(response.json()["ids"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=20_000)
+    parser.add_argument("--single-posts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        user = seed_user(db, "bench_bulk@example.com")
+    headers = auth_headers(user)
+
+    with serve({}, args.port) as base_url:
+        # POST /posts cycles through the same bodies, load() only varies the paths
+        single = [orjson.dumps(post) for post in make_posts(args.concurrency, "single")]
+
+        async def post_singles():
+            async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=30) as client:
+                async def worker(worker_id: int):
+                    for i in range(worker_id, args.single_posts, args.concurrency):
+                        response = await client.post(
+                            "/posts/", content=single[worker_id], headers={"Content-Type": "application/json"}
+                        )
+                        response.raise_for_status()
+
+                await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+
+        asyncio.run(load(base_url, ["/"], headers, 1, 1))  # Warm up the server
+        start = time.perf_counter()
+        asyncio.run(post_singles())
+        seconds = time.perf_counter() - start
+        print(f"{'POST /posts':>24}: {args.single_posts / seconds:,.0f} posts/s ({args.concurrency} clients)")
+
+        posts = make_posts(args.posts, "bulk")
+        bodies = {
+            "bulk, JSON array": (orjson.dumps(posts), "application/json"),
+            "bulk, NDJSON": (b"\n".join(orjson.dumps(post) for post in posts), "application/x-ndjson"),
+        }
+        for label, (body, content_type) in bodies.items():
+            start = time.perf_counter()
+            created = post_bulk(base_url, headers, body, content_type)
+            seconds = time.perf_counter() - start
+            print(f"{label:>24}: {created / seconds:,.0f} posts/s ({created} posts in {seconds:.2f}s)")
+
+    with SessionLocal() as db:
+        seed_user(db, "bench_bulk@example.com")  # Drops the posts created
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Cold start: importing the app, and spawning gunicorn workers with and without --preload
+
+    python -m benchmarks.cold_start --workers 4 --repeat 5
+
+Needs gunicorn, and a database migrated to the latest revision since the workers check it as they
+start. A worker is up once it logs the end of its startup, the times are counted from the launch
+of gunicorn.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import List
+
+from .common import summarize
+
+
+IMPORT = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+# What each worker did before the tables came from the migrations only
+IMPORT_CREATE_ALL = (
+    "import time; start = time.perf_counter(); import app.main, app.models as models; "
+    "models.Base.metadata.create_all(bind=app.main.database.get_engine()); print(time.perf_counter() - start)"
+)
+
+
+def time_import(code: str) -> float:
+    """Milliseconds taken by code in a new interpreter, as it prints them"""
+    return float(subprocess.check_output([sys.executable, "-c", code])) * 1000
+
+
+def spawn_workers(workers: int, preload: bool, port: int) -> List[float]:
+    """Milliseconds from launching gunicorn to each of its workers completing its startup"""
+    command = [
+        sys.executable, "-m", "gunicorn", "app.main:app",
+        "--workers", str(workers),
+        "--worker-class", "uvicorn.workers.UvicornWorker",
+        "--bind", f"127.0.0.1:{port}",
+        "--log-level", "info",
+    ]
+    if preload:
+        command.append("--preload")
+    started_at = time.perf_counter()
+    server = subprocess.Popen(command, stderr=subprocess.PIPE, text=True, env=os.environ)
+    ready: List[float] = []
+    all_ready = threading.Event()
+
+    def read_log():
+        for line in server.stderr:
+            if "Application startup complete" in line:
+                ready.append((time.perf_counter() - started_at) * 1000)
+                if len(ready) == workers:
+                    all_ready.set()
+            elif "Application startup failed" in line:
+                print(line, end="", file=sys.stderr)
+
+    threading.Thread(target=read_log, daemon=True).start()
+    try:
+        if not all_ready.wait(60):
+            raise RuntimeError(f"Only {len(ready)} of the {workers} workers started")
+        return ready
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for label, code in (("import", IMPORT), ("import + create_all", IMPORT_CREATE_ALL)):
+        stats = summarize([time_import(code) for _ in range(args.repeat)])
+        print(f"{label:>30}: " + ", ".join(f"{k}={v:.1f}" for k, v in stats.items()))
+
+    for preload in (False, True):
+        first, last = [], []
+        for _ in range(args.repeat):
+            ready = spawn_workers(args.workers, preload, args.port)
+            first.append(ready[0])
+            last.append(ready[-1])
+        label = f"{args.workers} workers" + (" --preload" if preload else "")
+        for which, durations in (("first", first), ("all", last)):
+            stats = summarize(durations)
+            print(f"{label + ', ' + which + ' up':>30}: " + ", ".join(f"{k}={v:.1f}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Helpers shared by the benchmarks, which run against the database configured through app.config"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal
+from app.oauth2 import create_access_token
+from app.utils import hash_pw
+
+
+BENCH_PASSWORD = "bench_password"
+
+
+def seed_user(db: Session, email: str) -> models.User:
+    """Create the benchmark user, dropping the one (and its posts) left by a previous run"""
+    db.query(models.User).filter(models.User.email == email).delete()
+    user = models.User(email=email, password=hash_pw(BENCH_PASSWORD))
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+@contextmanager
+def bench_user(email: str) -> Iterator[Tuple[Session, models.User]]:
+    """A session and the benchmark user seeded in it, deleted with its posts afterwards"""
+    db = SessionLocal()
+    user = seed_user(db, email)
+    try:
+        yield db, user
+    finally:
+        db.delete(user)  # Cascades to the seeded posts
+        db.commit()
+        db.close()
+
+
+def seed_posts(db: Session, user_id: int, count: int, chunk_size: int = 10_000):
+    """Insert count posts one second apart, so created_at orders them like a real feed"""
+    start = datetime.now(timezone.utc) - timedelta(seconds=count)
+    for chunk_start in range(0, count, chunk_size):
+        db.execute(
+            insert(models.Post),
+            [
+                {
+                    "title": f"bench title {i}",
+                    "content": f"bench content {i}",
+                    "user_id": user_id,
+                    "created_at": start + timedelta(seconds=i),
+                }
+                for i in range(chunk_start, min(chunk_start + chunk_size, count))
+            ],
+        )
+    db.commit()
+
+
+def auth_headers(user: models.User) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {create_access_token({'user_id': user.id})}"}
+
+
+def time_calls(call: Callable[[], object], repeat: int, warmup: int = 3) -> List[float]:
+    """Return the duration of each call in milliseconds"""
+    for _ in range(warmup):
+        call()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    quantiles = statistics.quantiles(durations, n=100, method="inclusive")
+    return {
+        "mean_ms": statistics.mean(durations),
+        "p50_ms": quantiles[49],
+        "p95_ms": quantiles[94],
+        "p99_ms": quantiles[98],
+    }
+
+
+def report(label: str, durations: List[float], seconds: float) -> str:
+    stats = summarize(durations)
+    return f"{label:>10}: {len(durations) / seconds:.1f} req/s, " + ", ".join(
+        f"{k}={v:.2f}" for k, v in stats.items()
+    )
+
+
+async def wait_until_up(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                await client.get("/")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def load(
+    base_url: str, paths, headers, concurrency: int, duration: float, method="GET", data=None
+):
+    durations = []
+    deadline = time.monotonic() + duration
+
+    async def worker(client: httpx.AsyncClient, worker_id: int):
+        i = worker_id
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            response = await client.request(method, paths[i % len(paths)], data=data)
+            response.raise_for_status()
+            durations.append((time.perf_counter() - start) * 1000)
+            i += concurrency
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client, i) for i in range(concurrency)))
+    return durations
+
+
+def load_server(
+    env: Dict[str, str],
+    port: int,
+    paths: List[str],
+    headers: Dict[str, str],
+    concurrency: int,
+    duration: float,
+    method: str = "GET",
+    data: Optional[Dict[str, str]] = None,
+) -> List[float]:
+    """Start uvicorn with the env overrides and request paths from concurrency clients for duration seconds.
+
+    Returns the duration of each request in milliseconds.
+    """
+    with serve(env, port) as base_url:
+        asyncio.run(load(base_url, paths, headers, concurrency, 2, method, data))  # Warm up the pools and caches
+        return asyncio.run(load(base_url, paths, headers, concurrency, duration, method, data))
+
+
+@contextmanager
+def serve(env: Dict[str, str], port: int) -> Iterator[str]:
+    """Run the app in uvicorn with the env overrides, yield its base url once it answers"""
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+    )
+    try:
+        asyncio.run(wait_until_up(base_url))
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def server_parser(doc: str, concurrency: int = 64) -> argparse.ArgumentParser:
+    """The arguments of the benchmarks loading servers, described by the first line of their doc"""
+    parser = argparse.ArgumentParser(description=doc.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=concurrency)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    return parser
+
+
+def compare_servers(
+    variants: Iterable[Tuple[str, Dict[str, str]]],
+    args: argparse.Namespace,
+    paths: List[str],
+    headers: Dict[str, str],
+    **request,
+):
+    """Load a server per (label, env overrides) variant in turn and print the report of each"""
+    for label, env in variants:
+        durations = load_server(env, args.port, paths, headers, args.concurrency, args.duration, **request)
+        print(report(label, durations, args.duration))
@@ -0,0 +1,76 @@
+"""Bytes on the wire and compression time of feed pages, per encoding, level and page size
+
+    python -m benchmarks.compression --page-sizes 10,100,1000
+
+The pages are serialized like GET /posts serves them, from posts of varied free text, and compressed
+as app.compression does. Nothing is served, so no database or server is needed.
+"""
+import argparse
+import random
+from datetime import datetime, timezone
+
+from app import compression, serialization
+from app.config import settings
+
+from .common import summarize, time_calls
+
+
+WORDS = (
+    "the a of to and in is it you that he was for on are with as his they be at one have this from "
+    "post blog fastapi python database query index vote feed page cache server client response "
+    "compression latency throughput benchmark worker request route user token replica partition"
+).split()
+
+# Encoding -> the setting of its level and the levels to try
+LEVELS = {
+    "gzip": ("compression_gzip_level", [1, 6, 9]),
+    "br": ("compression_brotli_level", [1, 4, 6, 11]),
+    "zstd": ("compression_zstd_level", [1, 3, 9, 19]),
+}
+
+
+def make_page(size: int, rng: random.Random) -> bytes:
+    now = datetime.now(timezone.utc).isoformat()
+    return serialization.dumps(
+        [
+            {
+                "id": i,
+                "title": " ".join(rng.choices(WORDS, k=rng.randint(3, 10))),
+                "content": " ".join(rng.choices(WORDS, k=rng.randint(20, 200))),
+                "published": True,
+                "created_at": now,
+                "user_id": rng.randint(1, 1000),
+                "votes": rng.randint(0, 500),
+                "version": 1,
+            }
+            for i in range(size)
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-sizes", default="10,100,1000")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in (int(size) for size in args.page_sizes.split(",")):
+        page = make_page(size, rng)
+        print(f"Pages of {size} posts, {len(page):,} bytes uncompressed")
+        for encoding, (setting, levels) in LEVELS.items():
+            if encoding not in compression.COMPRESSORS:
+                print(f"{encoding:>6}: not installed")
+                continue
+            for level in levels:
+                setattr(settings, setting, level)
+                compressed = compression.compress(encoding, page)
+                stats = summarize(time_calls(lambda: compression.compress(encoding, page), args.repeat))
+                print(
+                    f"{encoding:>6} {level:>2}: {len(compressed):>10,} bytes ({len(compressed) / len(page):6.1%}), "
+                    + ", ".join(f"{k}={v:.3f}" for k, v in stats.items())
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""Throughput of concurrent POST /login, hashing passwords in the threadpool vs the process pool
+
+    python -m benchmarks.login --concurrency 32 --duration 20 --rounds 12
+"""
+from .common import BENCH_PASSWORD, bench_user, compare_servers, server_parser
+
+
+def main():
+    parser = server_parser(__doc__, concurrency=32)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    with bench_user("bench_login@bench.com") as (db, user):
+        data = {"username": user.email, "password": BENCH_PASSWORD}
+        rounds = {"BCRYPT_ROUNDS": str(args.rounds)}
+        modes = (("threadpool", {**rounds, "PASSWORD_HASH_WORKERS": "0"}), ("processes", rounds))
+        compare_servers(modes, args, ["/login"], {}, method="POST", data=data)
+
+
+if __name__ == "__main__":
+    main()
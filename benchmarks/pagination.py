@@ -0,0 +1,59 @@
+"""Latency of a deep page of GET /posts, offset vs cursor pagination
+
+    python -m benchmarks.pagination --posts 100000 --page 1000
+"""
+import argparse
+
+from fastapi.testclient import TestClient
+
+from app import models
+from app.database import SessionLocal
+from app.main import app
+from app.pagination import encode_cursor
+
+from .common import auth_headers, seed_posts, seed_user, summarize, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    user = seed_user(db, "bench_pagination@bench.com")
+    try:
+        seed_posts(db, user.id, args.posts)
+        skip = (args.page - 1) * args.page_size
+        # The cursor a client would hold after walking the previous pages
+        last_of_previous_page = (
+            db.query(models.Post)
+            .order_by(models.Post.created_at.desc(), models.Post.id.desc())
+            .offset(skip - 1)
+            .first()
+        )
+        cursor = encode_cursor(last_of_previous_page)
+
+        client = TestClient(app)
+        client.headers.update(auth_headers(user))
+        params = {
+            "offset": {"limit": args.page_size, "skip": skip},
+            "cursor": {"limit": args.page_size, "cursor": cursor},
+        }
+        print(f"Page {args.page} of {args.page_size} posts out of {args.posts}")
+        for mode, mode_params in params.items():
+            durations = time_calls(
+                lambda: client.get("/posts", params=mode_params), args.repeat
+            )
+            stats = summarize(durations)
+            print(f"{mode:>6}: " + ", ".join(f"{k}={v:.2f}" for k, v in stats.items()))
+    finally:
+        db.delete(user)  # Cascades to the seeded posts
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
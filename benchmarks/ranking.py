@@ -0,0 +1,74 @@
+"""Latency of the top and hot feeds read from post_rankings vs ranked on demand from the votes
+
+    python -m benchmarks.ranking --users 1000 --posts 100000 --votes 1000000
+
+The on demand queries count the votes of every post to sort them, which is what post_rankings
+spares the feed. The response cache is cleared before each request so every call reads the database.
+"""
+import argparse
+
+from fastapi.testclient import TestClient
+from sqlalchemy import Float, cast, func, select
+
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.main import app
+from app.ranking import refresh_all_rankings
+from app.routers.post import post_cache
+
+from . import seed
+from .common import auth_headers, summarize, time_calls
+
+
+def on_demand(sort: str):
+    votes = func.count(models.Vote.user_id)
+    if sort == "top":
+        score = votes
+    else:
+        score = func.log(votes + 1) + (
+            cast(func.extract("epoch", models.Post.created_at), Float) / settings.hot_decay_seconds
+        )
+    return (
+        select(models.Post.id, votes)
+        .outerjoin(models.Vote, models.Vote.post_id == models.Post.id)
+        .group_by(models.Post.id)
+        .order_by(score.desc(), models.Post.id.desc())
+        .limit(10)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--votes", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user_ids = seed.seed(db, args.users, args.posts, args.votes)
+        refresh_all_rankings(db)
+        client = TestClient(app)
+        client.headers.update(auth_headers(db.get(models.User, user_ids[0])))
+
+        def read(sort: str):
+            post_cache.local.clear()
+            client.get("/posts/", params={"sort": sort}).raise_for_status()
+
+        print(f"{args.votes} votes on {args.posts} posts, first page of 10")
+        for sort in ("new", "top", "hot"):
+            stats = summarize(time_calls(lambda: read(sort), args.repeat))
+            print(f"{sort + ' (rankings)':>16}: " + ", ".join(f"{k}={v:.2f}" for k, v in stats.items()))
+        for sort in ("top", "hot"):
+            query = on_demand(sort)
+            stats = summarize(time_calls(lambda: db.execute(query).all(), max(args.repeat // 10, 2), warmup=1))
+            print(f"{sort + ' (on demand)':>16}: " + ", ".join(f"{k}={v:.2f}" for k, v in stats.items()))
+    finally:
+        seed.drop(db)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Seed the database with users, posts and votes for the benchmarks
+
+    python -m benchmarks.seed --users 100 --posts 10000 --votes 50000
+    python -m benchmarks.seed --drop
+
+The seeded users share the password BENCH_PASSWORD and their emails start with
+bench_suite_, which is how --drop finds them again.
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app import models
+from app.commands import reconcile_votes
+from app.database import SessionLocal
+from app.utils import hash_pw
+
+from .common import BENCH_PASSWORD
+
+
+EMAIL_PREFIX = "bench_suite_"
+CHUNK_SIZE = 10_000
+
+
+def drop(db: Session):
+    db.query(models.User).filter(models.User.email.like(f"{EMAIL_PREFIX}%")).delete(
+        synchronize_session=False
+    )  # Cascades to their posts and votes
+    db.commit()
+
+
+def seed(db: Session, users: int, posts: int, votes: int, seed: int = 0) -> List[int]:
+    """Replace the seeded data, return the ids of the users"""
+    drop(db)
+    rng = random.Random(seed)
+    password = hash_pw(BENCH_PASSWORD)  # Hashing is slow, and every user gets the same anyway
+    user_ids = db.execute(
+        insert(models.User)
+        .values([{"email": f"{EMAIL_PREFIX}{i}@bench.com", "password": password} for i in range(users)])
+        .returning(models.User.id)
+    ).scalars().all()
+
+    # Spread over the authors, one second apart so created_at orders them like a real feed
+    start = datetime.now(timezone.utc) - timedelta(seconds=posts)
+    for chunk_start in range(0, posts, CHUNK_SIZE):
+        db.execute(
+            insert(models.Post),
+            [
+                {
+                    "title": f"bench title {i}",
+                    "content": f"bench content {i}",
+                    "user_id": user_ids[i % users],
+                    "created_at": start + timedelta(seconds=i),
+                }
+                for i in range(chunk_start, min(chunk_start + CHUNK_SIZE, posts))
+            ],
+        )
+    post_ids = [
+        post_id
+        for post_id, in db.query(models.Post.id).filter(models.Post.user_id.in_(user_ids)).order_by(models.Post.id)
+    ]
+
+    # Distinct (user, post) pairs drawn without building the whole users x posts product
+    pairs = rng.sample(range(users * posts), min(votes, users * posts))
+    for chunk_start in range(0, len(pairs), CHUNK_SIZE):
+        db.execute(
+            insert(models.Vote),
+            [
+                {"user_id": user_ids[pair // posts], "post_id": post_ids[pair % posts]}
+                for pair in pairs[chunk_start:chunk_start + CHUNK_SIZE]
+            ],
+        )
+    db.commit()
+    reconcile_votes(db)
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--votes", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drop", action="store_true", help="only remove the seeded data")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.drop:
+            drop(db)
+        else:
+            seed(db, args.users, args.posts, args.votes, args.seed)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
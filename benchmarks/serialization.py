@@ -0,0 +1,66 @@
+"""Cost of serializing a page of the feed: pydantic then json as before, pydantic then orjson, rows then orjson
+
+    python -m benchmarks.serialization --page-size 100
+
+The posts come from an in memory SQLite database, so no server is needed: as ORM objects for the
+pydantic paths, as the rows the feed selects for the fast path.
+"""
+import argparse
+import json
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app import models, schemas, serialization
+from app.database import Base
+from app.routers.post import FEED_COLUMNS
+
+from .common import summarize, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+    with Session(engine) as db:
+        db.execute(
+            insert(models.Post),
+            [
+                {
+                    "title": f"title {i}",
+                    "content": f"content {i} " * 20,
+                    "user_id": 1,
+                    "created_at": now,
+                    "vote_count": i,
+                }
+                for i in range(args.page_size)
+            ],
+        )
+        posts = db.query(models.Post).all()
+        rows = db.execute(select(*FEED_COLUMNS)).all()
+
+    response_type = List[schemas.PostWithVotes]
+    paths = {
+        "pydantic + json": lambda: json.dumps(
+            jsonable_encoder(parse_obj_as(response_type, posts))
+        ).encode(),
+        "pydantic + orjson": lambda: serialization.dump_model(response_type, posts),
+        "rows + orjson": lambda: serialization.dump_rows(rows),
+    }
+    print(f"Pages of {args.page_size} posts")
+    for label, serialize in paths.items():
+        stats = summarize(time_calls(serialize, args.repeat))
+        print(f"{label:>18}: " + ", ".join(f"{k}={v:.3f}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Latency and throughput of every router, in process and over HTTP, saved as JSON
+
+    python -m benchmarks.suite --users 100 --posts 10000 --votes 50000 --duration 10
+    python -m benchmarks.suite --compare benchmarks/results/<previous commit>.json
+
+Seeds the database (see benchmarks.seed), then runs each scenario for --duration seconds from
+--concurrency clients: first against the ASGI app in this process, then against a uvicorn server.
+The app reads its settings from the environment as usual, in both modes.
+Results go to benchmarks/results/<commit>.json unless --output says otherwise.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app import models
+from app.database import SessionLocal
+
+from . import seed
+from .common import BENCH_PASSWORD, auth_headers, serve, summarize
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    # Request number -> path and the extra arguments of httpx.AsyncClient.request
+    request: Callable[[int], Tuple[str, dict]]
+    headers: Dict[str, str] = field(default_factory=dict)
+    statuses: Sequence[int] = (200,)
+
+
+def build_scenarios(post_ids: List[int], user: models.User, voter: models.User) -> List[Scenario]:
+    headers = auth_headers(user)
+    return [
+        Scenario("feed", "GET", lambda i: ("/posts/?limit=10", {}), headers),
+        Scenario("post", "GET", lambda i: (f"/posts/{post_ids[i % len(post_ids)]}", {}), headers),
+        Scenario("latest", "GET", lambda i: ("/posts/latest", {}), headers),
+        Scenario(
+            "login",
+            "POST",
+            lambda i: ("/login", {"data": {"username": user.email, "password": BENCH_PASSWORD}}),
+        ),
+        Scenario(
+            "create_post",
+            "POST",
+            lambda i: ("/posts/", {"json": {"title": f"suite title {i}", "content": f"suite content {i}"}}),
+            headers,
+            statuses=(201,),
+        ),
+        # The voter upvotes every post then removes the upvotes. Concurrent clients may still
+        # collide on a post, which is a 409
+        Scenario(
+            "vote",
+            "POST",
+            lambda i: ("/votes/", {"json": {"post_id": post_ids[i % len(post_ids)], "dir": 1 - i // len(post_ids) % 2}}),
+            auth_headers(voter),
+            statuses=(201, 409),
+        ),
+    ]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: Scenario, concurrency: int, duration: float
+) -> Dict[str, float]:
+    durations = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        i = worker_id
+        while time.monotonic() < deadline:
+            path, kwargs = scenario.request(i)
+            start = time.perf_counter()
+            response = await client.request(scenario.method, path, headers=scenario.headers, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code in scenario.statuses:
+                durations.append(elapsed)
+            else:
+                errors += 1
+            i += concurrency
+
+    start = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - start
+    results = {"requests": len(durations), "errors": errors, "throughput_rps": len(durations) / elapsed}
+    if len(durations) > 1:
+        results.update(summarize(durations))
+    return results
+
+
+async def run_all(client: httpx.AsyncClient, scenarios: List[Scenario], args) -> Dict[str, Dict]:
+    results = {}
+    for scenario in scenarios:
+        await run_scenario(client, scenario, args.concurrency, args.warmup)
+        results[scenario.name] = await run_scenario(client, scenario, args.concurrency, args.duration)
+        print(f"  {scenario.name:>12}: " + ", ".join(f"{k}={v:.2f}" for k, v in results[scenario.name].items()))
+    return results
+
+
+def in_process(scenarios: List[Scenario], args) -> Dict[str, Dict]:
+    from app.main import app  # Imported late, the seeding has to work without the app's side effects
+
+    async def run():
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(app=app, base_url="http://bench", limits=limits, timeout=30) as client:
+            return await run_all(client, scenarios, args)
+
+    return asyncio.run(run())
+
+
+def over_http(scenarios: List[Scenario], args) -> Dict[str, Dict]:
+    async def run(base_url: str):
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            return await run_all(client, scenarios, args)
+
+    with serve({}, args.port) as base_url:
+        return asyncio.run(run(base_url))
+
+
+MODES = {"inprocess": in_process, "http": over_http}
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous: Dict, current: Dict):
+    """Print how p95 latency and throughput moved since the previous results"""
+    print(f"Compared to {previous['commit']}:")
+    for mode, scenarios in current["results"].items():
+        for name, stats in scenarios.items():
+            before = previous["results"].get(mode, {}).get(name)
+            if not before or "p95_ms" not in before or "p95_ms" not in stats:
+                continue
+            p95 = (stats["p95_ms"] / before["p95_ms"] - 1) * 100
+            throughput = (stats["throughput_rps"] / before["throughput_rps"] - 1) * 100
+            print(f"  {mode:>9} {name:>12}: p95 {p95:+.1f}%, throughput {throughput:+.1f}%")
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--votes", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--scenarios", nargs="+", help="names of the scenarios to run, all by default")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path, help="results of a previous run")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        user_ids = seed.seed(db, args.users, args.posts, args.votes, args.seed)
+        user = db.get(models.User, user_ids[0])
+        # Votes from a user without seeded ones, so the vote scenario starts with upvotes
+        voter = models.User(email=f"{seed.EMAIL_PREFIX}voter@bench.com", password=user.password)
+        db.add(voter)
+        db.commit()
+        post_ids = [post_id for post_id, in db.query(models.Post.id).filter(models.Post.user_id.in_(user_ids))]
+
+        scenarios = build_scenarios(post_ids, user, voter)
+        if args.scenarios:
+            scenarios = [scenario for scenario in scenarios if scenario.name in args.scenarios]
+
+        results = {}
+        for mode in args.modes:
+            print(f"{mode}:")
+            results[mode] = MODES[mode](scenarios, args)
+    finally:
+        seed.drop(db)
+        db.close()
+
+    commit = current_commit()
+    output = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key not in ("output", "compare", "scenarios")
+        },
+        "results": results,
+    }
+    path = args.output or RESULTS_DIR / f"{commit}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(output, indent=2))
+    print(f"Saved to {path}")
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""Requests per second of GET /posts/{id} with and without the authenticated user cache
+
+    python -m benchmarks.user_cache --concurrency 64 --duration 20
+"""
+from app import models
+
+from .common import auth_headers, bench_user, compare_servers, seed_posts, server_parser
+
+
+def main():
+    parser = server_parser(__doc__)
+    parser.add_argument("--posts", type=int, default=100)
+    args = parser.parse_args()
+
+    with bench_user("bench_user_cache@bench.com") as (db, user):
+        seed_posts(db, user.id, args.posts)
+        post_ids = db.query(models.Post.id).filter(models.Post.user_id == user.id)
+        paths = [f"/posts/{post_id}" for post_id, in post_ids]
+        modes = (("no cache", {"USER_CACHE_SIZE": "0"}), ("cache", {}))
+        compare_servers(modes, args, paths, auth_headers(user))
+
+
+if __name__ == "__main__":
+    main()
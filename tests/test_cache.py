@@ -0,0 +1,131 @@
+import asyncio
+
+from app import models, ranking, schemas
+from app.cache import MemoryBackend, ModelCache, TTLCache
+from app.oauth2 import user_cache
+from app.routers.post import post_cache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache("test_lru", maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+
+def test_ttl_cache_expires(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now)
+    cache = TTLCache("test_ttl", maxsize=10, ttl=5)
+    cache.set("a", 1)
+    now += 4
+    assert cache.get("a") == 1
+    now += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_disabled():
+    cache = TTLCache("test_disabled", maxsize=0, ttl=5)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_model_cache_shared_backend():
+    backend = MemoryBackend()
+    user = schemas.UserResponse(id=1, email="shared@test.com", created_at="2023-01-01T00:00:00")
+    worker_1 = ModelCache("test_shared", schemas.UserResponse, 10, 30, backend)
+    worker_2 = ModelCache("test_shared", schemas.UserResponse, 10, 30, backend)
+
+    asyncio.run(worker_1.set(1, user))
+    assert asyncio.run(worker_2.get(1)) == user
+    asyncio.run(worker_1.invalidate(1))
+    assert asyncio.run(ModelCache("test_shared", schemas.UserResponse, 10, 30, backend).get(1)) is None
+
+
+def test_current_user_cached(authorized_client, test_user):
+    authorized_client.get("/posts")
+    hits = user_cache.local.hits
+    assert authorized_client.get("/posts").status_code == 200
+    assert user_cache.local.hits == hits + 1
+
+
+def test_current_user_invalidated_on_update(authorized_client, session, test_user):
+    authorized_client.get("/posts")
+    assert user_cache.local.get(test_user["id"]) is not None
+    user = session.get(models.User, test_user["id"])
+    user.email = "updated@test.com"
+    session.commit()
+    assert user_cache.local.get(test_user["id"]) is None
+    response = authorized_client.get(f"/users/{test_user['id']}")
+    assert response.json()["email"] == "updated@test.com"
+
+
+def test_post_response_cached_with_etag(authorized_client, test_posts):
+    post_id = test_posts[0].id
+    first = authorized_client.get(f"/posts/{post_id}")
+    hits = post_cache.local.hits
+    second = authorized_client.get(f"/posts/{post_id}")
+    assert post_cache.local.hits == hits + 1
+    assert second.json() == first.json()
+    assert second.headers["etag"] == first.headers["etag"]
+
+    response = authorized_client.get(f"/posts/{post_id}", headers={"If-None-Match": first.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_post_response_invalidated_on_vote(authorized_client, test_posts):
+    post_id = test_posts[3].id
+    assert authorized_client.get(f"/posts/{post_id}").json()["votes"] == 0
+    authorized_client.post("/votes", json={"post_id": post_id, "dir": 1})
+    assert authorized_client.get(f"/posts/{post_id}").json()["votes"] == 1
+
+
+def test_post_response_invalidated_after_ranking(authorized_client, test_posts, monkeypatch):
+    calls = []
+    refresh_rankings, invalidate = ranking.refresh_rankings, post_cache.invalidate
+
+    async def record_refresh(db, post_ids):
+        calls.append("refresh")
+        await refresh_rankings(db, post_ids)
+
+    async def record_invalidate():
+        calls.append("invalidate")
+        await invalidate()
+
+    monkeypatch.setattr(ranking, "refresh_rankings", record_refresh)
+    monkeypatch.setattr(post_cache, "invalidate", record_invalidate)
+    authorized_client.post("/votes", json={"post_id": test_posts[3].id, "dir": 1})
+    # The ranked pages cached while the rankings were refreshed are dropped too
+    assert calls == ["invalidate", "refresh", "invalidate"]
+
+
+def test_post_response_invalidated_on_update(authorized_client, test_posts):
+    post_id = test_posts[0].id
+    etag = authorized_client.get("/posts/").headers["etag"]
+    authorized_client.put(f"/posts/{post_id}", json={"title": "updated", "content": "updated"})
+    response = authorized_client.get("/posts/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "updated" in [post["title"] for post in response.json()]
+
+
+def test_response_cache_shared_backend(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(post_cache, "backend", MemoryBackend())
+    post_id = test_posts[3].id
+    first = authorized_client.get(f"/posts/{post_id}")
+    assert authorized_client.get(f"/posts/{post_id}").json() == first.json()
+    authorized_client.post("/votes", json={"post_id": post_id, "dir": 1})
+    assert authorized_client.get(f"/posts/{post_id}").json()["votes"] == 1
+
+
+def test_post_response_cache_key_escapes_query(authorized_client, test_posts):
+    # Both would be keyed search=1st&zz=1 if the values weren't escaped
+    response = authorized_client.get("/posts/", params={"search": "1st&zz=1"})
+    assert response.json() == []
+    response = authorized_client.get("/posts/?search=1st&zz=1")
+    assert [post["title"] for post in response.json()] == ["1st title"]
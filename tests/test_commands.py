@@ -0,0 +1,37 @@
+from app import models
+from app.commands import explain_queries, find_seq_scans
+
+
+def test_explain_queries(session, test_posts):
+    post_count = session.query(models.Post).count()
+    with session.get_bind().connect() as connection:
+        plans = explain_queries(connection)
+    statements = [plan.statement for plan in plans]
+    assert any(statement.startswith("INSERT INTO votes") for statement in statements)
+    assert any(statement.startswith("INSERT INTO post_rankings") for statement in statements)
+    assert any(statement.startswith("UPDATE posts SET deleted_at") for statement in statements)
+    assert any(statement.endswith("ORDER BY posts.id") for statement in statements)  # The export
+    assert any(statement.startswith("UPDATE posts SET title=%(title)s, version=") for statement in statements)
+    assert any("nextval" in statement for statement in statements)  # The ids of POST /posts/bulk
+    assert any(statement.startswith("INSERT INTO revoked_tokens") for statement in statements)
+    assert all(plan.execution_ms >= 0 for plan in plans)
+    # Neither the requests nor EXPLAIN ANALYZE left anything behind
+    assert session.query(models.Post).count() == post_count
+    assert session.query(models.Vote).count() == 0
+
+
+def test_find_seq_scans():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {
+                "Node Type": "Seq Scan",
+                "Relation Name": "votes",
+                "Actual Rows": 5,
+                "Rows Removed by Filter": 95,
+                "Actual Loops": 2,
+            },
+            {"Node Type": "Index Scan", "Relation Name": "posts", "Actual Rows": 1, "Actual Loops": 10},
+        ],
+    }
+    assert find_seq_scans(plan) == [("votes", 200)]
@@ -0,0 +1,87 @@
+import gzip
+
+import pytest
+
+from app.compression import COMPRESSORS, CompressionMiddleware, accepted_encodings, compressed_bodies
+from app.config import settings
+
+
+def decompress(encoding, data):
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        import brotli
+        return brotli.decompress(data)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def get_raw(client, path, headers):
+    """The response and its body as sent, which httpx would otherwise decompress"""
+    with client.stream("GET", path, headers=headers) as response:
+        return response, b"".join(response.iter_raw())
+
+
+@pytest.fixture
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(settings, "compression_minimum_size", 100)
+
+
+def test_choose_encoding():
+    assert accepted_encodings("gzip;q=0.5, br;q=0, *") == {"gzip": 0.5, "br": 0.0, "*": 1.0}
+    middleware = CompressionMiddleware(None, encodings=["gzip"])
+    assert middleware.choose("gzip, deflate") == "gzip"
+    assert middleware.choose("*") == "gzip"
+    assert middleware.choose("gzip;q=0, *") is None
+    assert middleware.choose("identity") is None
+    assert middleware.choose("") is None
+    if "br" in COMPRESSORS:
+        middleware = CompressionMiddleware(None, encodings=["br", "gzip"])
+        assert middleware.choose("gzip, br") == "br"
+        assert middleware.choose("gzip, br;q=0") == "gzip"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_compressed_feed(authorized_client, test_posts, small_threshold, encoding):
+    if encoding not in COMPRESSORS:
+        pytest.skip(f"{encoding} isn't installed")
+    plain, plain_body = get_raw(authorized_client, "/posts/", {"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    response, body = get_raw(authorized_client, "/posts/", {"Accept-Encoding": encoding})
+    assert response.headers["content-encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) == len(body)
+    assert decompress(encoding, body) == plain_body
+
+
+def test_small_body_uncompressed(authorized_client, test_user):
+    response, body = get_raw(authorized_client, f"/users/{test_user['id']}", {"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+
+def test_cached_page_compressed_once(authorized_client, test_posts, small_threshold):
+    compressed_bodies.clear()
+    headers = {"Accept-Encoding": "gzip"}
+    response, first = get_raw(authorized_client, "/posts/", headers)
+    hits = compressed_bodies.hits
+    response, second = get_raw(authorized_client, "/posts/", headers)
+    assert second == first
+    assert compressed_bodies.hits == hits + 1
+    # The ETag is weak once compressed, and still revalidates the page
+    etag = response.headers["etag"]
+    assert etag.startswith("W/")
+    response = authorized_client.get("/posts/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_compressed_stream(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "export_chunk_size", 1)
+    monkeypatch.setattr(settings, "compression_threadpool_size", 0)  # Every chunk goes to the threadpool
+    plain, plain_body = get_raw(authorized_client, "/posts/export", {"Accept-Encoding": "identity"})
+    response, body = get_raw(authorized_client, "/posts/export", {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(body) == plain_body
+    assert len(plain_body.splitlines()) == len(test_posts)
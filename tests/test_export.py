@@ -0,0 +1,99 @@
+import asyncio
+import os
+import tracemalloc
+from typing import Tuple
+
+import orjson
+from sqlalchemy import text
+
+from app.main import app
+from app.schemas import PostWithVotes
+
+
+# Enough to tell a constant memory from one growing with the rows. Set EXPORT_TEST_ROWS=1000000
+# for the full scale run, which takes a while
+EXPORT_TEST_ROWS = int(os.environ.get("EXPORT_TEST_ROWS", 100_000))
+
+
+def test_export_posts(authorized_client, test_posts):
+    response = authorized_client.get("/posts/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    posts = [PostWithVotes(**orjson.loads(line)) for line in response.content.splitlines()]
+    assert [post.id for post in posts] == sorted(post.id for post in test_posts)
+
+    response = authorized_client.get("/posts/export", params={"search": "extra"})
+    assert [orjson.loads(line)["title"] for line in response.content.splitlines()] == ["extra user title"]
+
+
+def test_export_posts_unauthorized(client):
+    assert client.get("/posts/export").status_code == 401
+
+
+def stream_export(token: str) -> Tuple[int, int]:
+    """Run GET /posts/export through the ASGI app, dropping the body as it comes like a client would.
+
+    Returns the bytes of the body and the peak of the memory allocated meanwhile.
+    """
+    async def export() -> int:
+        received = 0
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()  # The client never disconnects
+
+        async def send(message):
+            nonlocal received
+            if message["type"] == "http.response.body":
+                received += len(message.get("body", b""))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/posts/export",
+            "raw_path": b"/posts/export",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+            "client": ("testclient", 50000),
+            "server": ("testserver", 80),
+        }
+        await app(scope, receive, send)
+        return received
+
+    tracemalloc.start()
+    try:
+        received = asyncio.run(export())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return received, peak
+
+
+def test_export_posts_constant_memory(authorized_client, session, token, test_user):
+    def seed(rows):
+        session.execute(
+            text(
+                "INSERT INTO posts (title, content, user_id) "
+                "SELECT 'exported title', 'exported content', :user_id FROM generate_series(1, :rows)"
+            ),
+            {"user_id": test_user["id"], "rows": rows},
+        )
+        session.commit()
+
+    seed(10_000)
+    small_received, small_peak = stream_export(token)
+    seed(EXPORT_TEST_ROWS - 10_000)
+    received, peak = stream_export(token)
+
+    assert received > small_received * (EXPORT_TEST_ROWS // 10_000) * 0.9
+    # Holding the rows at once would take several times the size of the body
+    assert peak < small_peak * 2
+    assert peak < received / 5
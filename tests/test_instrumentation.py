@@ -0,0 +1,27 @@
+import logging
+
+from app import instrumentation
+from app.config import settings
+
+
+def test_server_timing_header(authorized_client, test_posts):
+    authorized_client.get("/posts/latest")  # Caches the user
+    response = authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert 'desc="1 statements"' in response.headers["server-timing"]
+    assert "db-slowest;dur=" in response.headers["server-timing"]
+
+
+def test_route_histograms(authorized_client, test_posts):
+    labels = {"method": "GET", "route": "/posts/{id}"}
+    statements = instrumentation.REQUEST_DB_STATEMENTS.count(**labels)
+    authorized_client.get(f"/posts/{test_posts[0].id}")
+    authorized_client.get(f"/posts/{test_posts[1].id}")
+    assert instrumentation.REQUEST_DB_STATEMENTS.count(**labels) == statements + 2
+    assert 'http_request_db_seconds_count{method="GET",route="/posts/{id}"' in authorized_client.get("/metrics").text
+
+
+def test_slow_statement_logged(authorized_client, test_posts, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_statement_ms", 1e-6)
+    with caplog.at_level(logging.WARNING, logger="app.instrumentation"):
+        authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert any(record.getMessage().startswith("Slow statement") for record in caplog.records)
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import QueuePool
+
+from app import metrics
+from app.database import POOL_CHECKOUTS, POOL_TIMEOUTS, POOL_WAIT, pool_options
+
+from .conftest import SQLALCHEMY_DATABASE_URL
+
+
+def test_get_metrics(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE db_pool_checkouts_total counter" in response.text
+
+
+def test_render_histogram():
+    histogram = metrics.Histogram("test_render_seconds", "Test histogram", ["route"], buckets=[0.1, 1])
+    histogram.observe(0.05, route="/")
+    histogram.observe(0.5, route="/")
+    histogram.observe(5, route="/")
+    rendered = metrics.render()
+    assert 'test_render_seconds_bucket{route="/",le="0.1",worker=' in rendered
+    assert [
+        line.rsplit(" ", 1)[1]
+        for line in rendered.splitlines()
+        if line.startswith("test_render_seconds_")
+    ] == ["1", "2", "3", "5.55", "3"]
+
+
+def test_pool_metrics():
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        **{**pool_options(QueuePool, "test"), "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.1},
+    )
+    with engine.connect():
+        assert POOL_CHECKOUTS.value(pool="test") == 1
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+    assert POOL_TIMEOUTS.value(pool="test") == 1
+    assert POOL_WAIT.count(pool="test") == 1
+    assert 'db_pool_checked_out{pool="test",' in metrics.render()
+    engine.dispose()
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from fastapi import HTTPException
+from jose import jwt
+
+from app import models, oauth2
+from app.database import ThreadedSession
+
+
+def private_pem(private_key) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+def public_pem(private_key) -> str:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+
+def test_verified_token_cached(token, test_user):
+    invalid = HTTPException(status_code=401)
+    hits = oauth2.verified_tokens.hits
+    assert oauth2.verify_access_token(token, invalid).id == str(test_user["id"])
+    assert oauth2.verify_access_token(token, invalid).id == str(test_user["id"])
+    assert oauth2.verified_tokens.hits == hits + 1
+
+
+def test_verified_token_expires(test_user):
+    invalid = HTTPException(status_code=401)
+    expires_at = int(time.time()) + 1
+    token = jwt.encode({"user_id": test_user["id"], "exp": expires_at}, oauth2.SIGNING_KEY, algorithm=oauth2.ALGORITHM)
+    oauth2.verify_access_token(token, invalid)
+    # jose compares exp to the current second
+    time.sleep(expires_at + 1.05 - time.time())
+    with pytest.raises(HTTPException):
+        oauth2.verify_access_token(token, invalid)
+
+
+@pytest.mark.parametrize(
+    "algorithm, generate_key",
+    [("ES256", lambda: ec.generate_private_key(ec.SECP256R1())), ("EdDSA", ed25519.Ed25519PrivateKey.generate)],
+)
+def test_asymmetric_algorithms(monkeypatch, authorized_client, test_user, algorithm, generate_key):
+    private_key = generate_key()
+    keys = oauth2.load_keys(algorithm, "", private_pem(private_key))
+    monkeypatch.setattr(oauth2, "ALGORITHM", algorithm)
+    monkeypatch.setattr(oauth2, "SIGNING_KEY", keys[0])
+    monkeypatch.setattr(oauth2, "VERIFYING_KEY", keys[1])
+
+    token = oauth2.create_access_token({"user_id": test_user["id"]})
+    assert jwt.get_unverified_header(token)["alg"] == algorithm
+    # Anyone with the public key can verify the tokens
+    assert jwt.decode(token, public_pem(private_key), algorithms=[algorithm])["user_id"] == test_user["id"]
+    response = authorized_client.get("/posts/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+    # Neither the HS256 tokens, nor those of another key pass
+    hs256_token = authorized_client.headers["Authorization"]
+    assert authorized_client.get("/posts/", headers={"Authorization": hs256_token}).status_code == 401
+    other_key = generate_key()
+    forged = jwt.encode({"user_id": test_user["id"], "exp": int(time.time()) + 60}, private_pem(other_key), algorithm=algorithm)
+    assert authorized_client.get("/posts/", headers={"Authorization": f"Bearer {forged}"}).status_code == 401
+
+
+def test_asymmetric_algorithm_needs_private_key():
+    with pytest.raises(ValueError):
+        oauth2.load_keys("ES256", "secret")
+
+
+def login(client, user) -> dict:
+    response = client.post("/login", data={"username": user["email"], "password": user["password"]})
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_posts(client, access_token: str) -> int:
+    return client.get("/posts/", headers={"Authorization": f"Bearer {access_token}"}).status_code
+
+
+def refresh(client, refresh_token: str):
+    return client.post("/token/refresh", json={"refresh_token": refresh_token})
+
+
+def test_refresh_token(client, test_user):
+    tokens = login(client, test_user)
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    assert get_posts(client, refreshed["access_token"]) == 200
+    assert refresh(client, refreshed["refresh_token"]).status_code == 200
+
+
+def test_refresh_token_reused(client, test_user):
+    tokens = login(client, test_user)
+    refreshed = refresh(client, tokens["refresh_token"]).json()
+    # Replaying a rotated refresh token revokes every token refreshed from the same login
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+    assert refresh(client, refreshed["refresh_token"]).status_code == 401
+    assert get_posts(client, refreshed["access_token"]) == 401
+    assert get_posts(client, login(client, test_user)["access_token"]) == 200
+
+
+def test_tokens_not_interchangeable(client, test_user):
+    tokens = login(client, test_user)
+    assert get_posts(client, tokens["refresh_token"]) == 401
+    assert refresh(client, tokens["access_token"]).status_code == 401
+
+
+def test_logout(client, test_user):
+    tokens = login(client, test_user)
+    other_tokens = login(client, test_user)
+    response = client.post("/logout", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 204
+    assert get_posts(client, tokens["access_token"]) == 401
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+    assert get_posts(client, other_tokens["access_token"]) == 200
+
+
+def test_revocation_synced(client, session, test_user):
+    tokens = login(client, test_user)
+    family = jwt.get_unverified_claims(tokens["access_token"])["fam"]
+    # Revoked by another worker
+    session.add(models.RevokedToken(jti=family, expires_at=datetime.now(timezone.utc) + timedelta(days=1)))
+    session.commit()
+    assert get_posts(client, tokens["access_token"]) == 200
+    asyncio.run(oauth2.revocation_list.sync(ThreadedSession(session)))
+    assert get_posts(client, tokens["access_token"]) == 401
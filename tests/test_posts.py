@@ -1,5 +1,13 @@
+import base64
+from typing import List
+
 import pytest
-from app.schemas import PostWithVotes, Post
+from sqlalchemy import update
+from app import models, serialization
+from app.config import settings
+from app.oauth2 import create_access_token
+from app.ranking import refresh_all_rankings
+from app.schemas import PostWithVotes, Post, PostPage
 
 
 def test_get_all_posts(authorized_client, test_posts):
@@ -12,6 +20,97 @@ def test_get_all_posts(authorized_client, test_posts):
     assert {post.id for post in posts} == {post.id for post in test_posts}
 
 
+def test_get_posts_serialized_like_the_schema(authorized_client, test_posts):
+    # The feed skips pydantic, it has to produce the same JSON as going through it would
+    response = authorized_client.get("/posts/")
+    by_id = {post.id: post for post in test_posts}
+    expected = serialization.dump_model(
+        List[PostWithVotes], [by_id[post["id"]] for post in response.json()]
+    )
+    assert response.content == expected
+
+
+def test_get_posts_null_published(authorized_client, test_posts, session):
+    # The column is nullable, the field defaults to True
+    session.execute(update(models.Post).where(models.Post.id == test_posts[0].id).values(published=None))
+    session.commit()
+    for params in ({}, {"cursor": ""}):
+        response = authorized_client.get("/posts/", params={**params, "limit": 100})
+        items = response.json() if not params else response.json()["items"]
+        post = next(item for item in items if item["id"] == test_posts[0].id)
+        assert post["published"] is True
+
+
+def test_get_posts_with_cursor(authorized_client, test_posts):
+    posts = []
+    cursor = ""
+    while cursor is not None:
+        response = authorized_client.get("/posts", params={"limit": 3, "cursor": cursor})
+        assert response.status_code == 200
+        page = PostPage(**response.json())
+        assert len(page.items) <= 3
+        posts.extend(page.items)
+        cursor = page.next_cursor
+    assert len(posts) == len(test_posts)
+    assert {post.id for post in posts} == {post.id for post in test_posts}
+    positions = [(post.created_at, post.id) for post in posts]
+    assert positions == sorted(positions, reverse=True)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor",
+        base64.urlsafe_b64encode(b'["2020-01-01T00:00:00", 1e400]').decode(),
+        base64.urlsafe_b64encode(b'["2020-01-01T00:00:00", 99999999999]').decode(),
+        base64.urlsafe_b64encode(b'["2020-01-01T00:00:00", 1.5]').decode(),
+    ],
+)
+def test_get_posts_invalid_cursor(authorized_client, test_posts, cursor):
+    response = authorized_client.get("/posts", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("sort", ["top", "hot"])
+def test_get_posts_ranked(authorized_client, session, test_posts, sort):
+    post_ids = [post.id for post in test_posts]
+    refresh_all_rankings(session)  # The fixture's posts didn't go through the routes
+    authorized_client.post("/votes", json={"post_id": post_ids[1], "dir": 1})
+    response = authorized_client.get("/posts", params={"sort": sort})
+    assert response.status_code == 200
+    # The voted post first, then the others newest first as they have the same age and votes
+    assert [post["id"] for post in response.json()] == [post_ids[1]] + sorted(
+        set(post_ids) - {post_ids[1]}, reverse=True
+    )
+
+
+def test_get_posts_ranked_includes_new_posts(authorized_client, test_posts):
+    new_post_id = authorized_client.post("/posts/", json={"title": "new", "content": "new"}).json()["id"]
+    response = authorized_client.get("/posts", params={"sort": "hot"})
+    assert [post["id"] for post in response.json()] == [new_post_id]
+
+
+def test_hot_score(session, test_posts):
+    refresh_all_rankings(session)
+    post = test_posts[0]
+    ranking = session.get(models.PostRanking, post.id)
+    assert ranking.votes == 0
+    assert ranking.hot == pytest.approx(post.created_at.timestamp() / settings.hot_decay_seconds)
+
+
+def test_get_posts_sorted_new(authorized_client, test_posts):
+    response = authorized_client.get("/posts", params={"sort": "new"})
+    posts = response.json()
+    assert [(post["created_at"], post["id"]) for post in posts] == sorted(
+        ((post["created_at"], post["id"]) for post in posts), reverse=True
+    )
+
+
+def test_get_posts_ranked_with_cursor(authorized_client, test_posts):
+    response = authorized_client.get("/posts", params={"sort": "top", "cursor": ""})
+    assert response.status_code == 400
+
+
 def test_unauthorized_user_get_all_posts(client, test_posts):
     response = client.get("/posts")
     assert response.status_code == 401
@@ -26,7 +125,7 @@ def test_get_one_post(authorized_client, test_posts):
 
 
 def test_get_one_post_not_exist(authorized_client, test_posts):
-    response = authorized_client.get(f"/posts/666")
+    response = authorized_client.get("/posts/666")
     assert response.status_code == 404
 
 
@@ -74,11 +173,82 @@ def test_unauthorized_user_create_post(client, test_posts):
     assert response.status_code == 401
 
 
+def test_create_posts_bulk(authorized_client, test_user, session):
+    posts = [
+        {"title": "title", "content": "content"},
+        {"title": "", "content": 'with "quotes", commas\nand lines', "published": False},
+        {"title": "last title", "content": "last content"},
+    ]
+    response = authorized_client.post("/posts/bulk", json=posts)
+    assert response.status_code == 201
+    ids = response.json()["ids"]
+    created = session.query(models.Post).order_by(models.Post.id).all()
+    assert [post.id for post in created] == ids
+    assert [(post.title, post.content, post.published) for post in created] == [
+        ("title", "content", True), ("", 'with "quotes", commas\nand lines', False), ("last title", "last content", True)
+    ]
+    assert all(post.user_id == test_user["id"] for post in created)
+    # The sequence moved past the copied ids
+    response = authorized_client.post("/posts", json={"title": "title", "content": "content"})
+    assert response.json()["id"] > ids[-1]
+
+
+def test_create_posts_bulk_ndjson(authorized_client, session, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_chunk_size", 2)
+    body = "\n".join(f'{{"title": "title {i}", "content": "content {i}"}}' for i in range(5)) + "\n"
+    response = authorized_client.post(
+        "/posts/bulk", content=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 201
+    assert len(response.json()["ids"]) == 5
+    assert [post.title for post in session.query(models.Post).order_by(models.Post.id)] == [
+        f"title {i}" for i in range(5)
+    ]
+
+
+def test_create_posts_bulk_invalid(authorized_client, session, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_chunk_size", 1)
+    posts = [{"title": "title", "content": "content"}, {"title": "no content"}]
+    response = authorized_client.post("/posts/bulk", json=posts)
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", 1, "content"]
+    # The chunk already copied was rolled back
+    assert session.query(models.Post).count() == 0
+
+    response = authorized_client.post(
+        "/posts/bulk", content="[{", headers={"Content-Type": "application/json"}
+    )
+    assert response.status_code == 400
+
+
+def test_unauthorized_user_create_posts_bulk(client, test_posts):
+    response = client.post("/posts/bulk", json=[{"title": "title", "content": "content"}])
+    assert response.status_code == 401
+
+
 def test_delete_post(authorized_client, test_posts):
     response = authorized_client.delete(f"posts/{test_posts[0].id}")
     assert response.status_code == 204
 
 
+def test_deleted_post_hidden(authorized_client, test_posts, session):
+    deleted = test_posts[2]  # The latest of the first user
+    assert authorized_client.delete(f"posts/{deleted.id}").status_code == 204
+    # Only marked, until purged
+    assert session.query(models.Post.deleted_at).filter(models.Post.id == deleted.id).scalar() is not None
+
+    assert authorized_client.get(f"/posts/{deleted.id}").status_code == 404
+    assert deleted.id not in [post["id"] for post in authorized_client.get("/posts/?limit=100").json()]
+    assert authorized_client.get("/posts/latest").json()["id"] != deleted.id
+    exported = authorized_client.get("/posts/export").text.splitlines()
+    assert len(exported) == len(test_posts) - 1
+    body = {"title": "title", "content": "content"}
+    assert authorized_client.put(f"/posts/{deleted.id}", json=body).status_code == 404
+    assert authorized_client.delete(f"posts/{deleted.id}").status_code == 404
+    assert authorized_client.post("/votes", json={"post_id": deleted.id, "dir": 1}).status_code == 404
+    assert session.query(models.Vote).count() == 0
+
+
 def test_unauthorized_user_delete_post(client, test_posts):
     response = client.delete(f"posts/{test_posts[0].id}")
     assert response.status_code == 401
@@ -130,3 +300,51 @@ def test_update_other_user_post(authorized_client, test_users, test_posts):
     data = {"title": "updated title", "content": "updated content"}
     response = authorized_client.put(f"posts/{second_user_post_id}", json=data)
     assert response.status_code == 403
+
+
+def test_patch_post(authorized_client, test_posts):
+    post_id = test_posts[0].id
+    response = authorized_client.patch(f"/posts/{post_id}", json={"title": "patched title"})
+    assert response.status_code == 200
+    patched_post = Post(**response.json())
+    assert (patched_post.title, patched_post.content) == ("patched title", test_posts[0].content)
+    assert patched_post.version == test_posts[0].version + 1
+    assert authorized_client.get(f"/posts/{post_id}").json()["title"] == "patched title"
+
+    assert authorized_client.patch(f"/posts/{post_id}", json={"content": None}).status_code == 422
+    assert authorized_client.patch("/posts/666", json={"title": "patched title"}).status_code == 404
+
+
+def test_update_post_if_match(authorized_client, test_posts):
+    post_id = test_posts[0].id
+    etag = authorized_client.get(f"/posts/{post_id}").headers["etag"]
+    data = {"title": "updated title", "content": "updated content"}
+    response = authorized_client.put(f"/posts/{post_id}", json=data, headers={"If-Match": etag})
+    assert response.status_code == 200
+    # The other editor still holds the previous ETag
+    for method in ("PUT", "PATCH", "DELETE"):
+        response = authorized_client.request(method, f"/posts/{post_id}", json=data, headers={"If-Match": etag})
+        assert response.status_code == 412
+    new_etag = authorized_client.get(f"/posts/{post_id}").headers["etag"]
+    response = authorized_client.patch(
+        f"/posts/{post_id}", json={"title": "again"}, headers={"If-Match": f"W/{etag}, {new_etag}"}
+    )
+    assert response.status_code == 200
+    assert authorized_client.delete(f"/posts/{post_id}", headers={"If-Match": "*"}).status_code == 204
+
+
+def test_update_post_if_match_ignores_votes(authorized_client, test_users, test_posts):
+    post_id = test_posts[0].id
+    etag = authorized_client.get(f"/posts/{post_id}").headers["etag"]
+    other_token = create_access_token({"user_id": test_users[1]["id"]})
+    response = authorized_client.post(
+        "/votes", json={"post_id": post_id, "dir": 1}, headers={"Authorization": f"Bearer {other_token}"}
+    )
+    assert response.status_code == 201
+    assert authorized_client.get(f"/posts/{post_id}").headers["etag"] != etag
+    # The ETag of another post doesn't match
+    other_etag = authorized_client.get(f"/posts/{test_posts[1].id}").headers["etag"]
+    response = authorized_client.patch(f"/posts/{post_id}", json={"title": "t"}, headers={"If-Match": other_etag})
+    assert response.status_code == 412
+    response = authorized_client.patch(f"/posts/{post_id}", json={"title": "t"}, headers={"If-Match": etag})
+    assert response.status_code == 200
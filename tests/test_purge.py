@@ -0,0 +1,37 @@
+import asyncio
+
+from sqlalchemy import text
+
+from app import models
+from app.database import ThreadedSession
+from app.purge import Purger
+
+
+def test_votes_partitioned(session):
+    partitions = session.execute(
+        text("SELECT count(*) FROM pg_inherits WHERE inhparent = 'votes'::regclass")
+    ).scalar()
+    assert partitions == models.VOTE_PARTITIONS
+
+
+def test_purge_deleted_posts(authorized_client, test_users, test_posts, session):
+    deleted, kept = test_posts[0], test_posts[3]
+    voters = [models.User(email=f"voter{i}@test.com", password="password") for i in range(5)]
+    session.add_all(voters)
+    session.commit()
+    session.add_all([models.Vote(post_id=post.id, user_id=voter.id) for post in (deleted, kept) for voter in voters])
+    session.commit()
+    assert authorized_client.delete(f"posts/{deleted.id}").status_code == 204
+
+    purger = Purger(batch_size=2)
+    db = ThreadedSession(session)
+    # Bounded batches: the votes two at a time, then the post
+    steps = [asyncio.run(purger.step(db)) for _ in range(4)]
+    assert steps == [(2, 0), (2, 0), (1, 1), (0, 0)]
+    assert session.query(models.Post).filter(models.Post.id == deleted.id).count() == 0
+    assert session.query(models.Vote).filter(models.Vote.post_id == deleted.id).count() == 0
+    # The other posts and their votes are left alone
+    assert session.query(models.Post).count() == len(test_posts) - 1
+    assert session.query(models.Vote).filter(models.Vote.post_id == kept.id).count() == len(voters)
+
+    assert asyncio.run(purger.purge(db)) == (0, 0)
@@ -0,0 +1,39 @@
+import pytest
+
+from app.routers.post import post_cache
+
+
+# The statements each route may execute once the authenticated user is cached, its background
+# tasks included
+@pytest.mark.parametrize(
+    "method, path, body, budget",
+    [
+        ("GET", "/posts/", None, 1),
+        ("GET", "/posts/?cursor=", None, 1),
+        ("GET", "/posts/latest", None, 1),
+        ("GET", "/posts/{own_post_id}", None, 1),
+        ("POST", "/posts/", {"title": "title", "content": "content"}, 2),
+        ("PUT", "/posts/{own_post_id}", {"title": "title", "content": "content"}, 1),
+        ("PATCH", "/posts/{own_post_id}", {"title": "title"}, 1),
+        ("DELETE", "/posts/{own_post_id}", None, 1),
+        ("POST", "/votes/", {"post_id": "{other_post_id}", "dir": 1}, 3),
+        ("POST", "/votes/batch", [{"post_id": "{other_post_id}", "dir": 1}], 5),
+        ("GET", "/users/{user_id}", None, 1),
+    ],
+)
+def test_query_budget(authorized_client, test_user, test_posts, query_budget, method, path, body, budget):
+    ids = {
+        "own_post_id": test_posts[0].id,
+        "other_post_id": test_posts[-1].id,
+        "user_id": test_user["id"],
+    }
+    path = path.format(**ids)
+    if isinstance(body, dict) and "post_id" in body:
+        body = {**body, "post_id": ids["other_post_id"]}
+    elif isinstance(body, list):
+        body = [{**vote, "post_id": ids["other_post_id"]} for vote in body]
+    authorized_client.get("/posts/latest")  # Caches the user
+    post_cache.local.clear()
+    with query_budget(budget):
+        response = authorized_client.request(method, path, json=body)
+    assert response.status_code < 400
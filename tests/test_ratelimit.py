@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from app import database, ratelimit
+from app.config import settings
+from app.cache import MemoryBackend
+from app.ratelimit import BackendStorage, Limit, MemoryStorage, parse_limit
+
+
+def test_parse_limit():
+    assert parse_limit("20/minute") == Limit(20, 60)
+    assert parse_limit("") is None
+
+
+def test_memory_storage_refills():
+    storage = MemoryStorage()
+    limit = Limit(2, 0.1)
+    assert asyncio.run(storage.take("key", limit)) == 0
+    assert asyncio.run(storage.take("key", limit)) == 0
+    assert 0 < asyncio.run(storage.take("key", limit)) <= 0.05
+    assert asyncio.run(storage.take("other key", limit)) == 0
+    time.sleep(0.05)
+    assert asyncio.run(storage.take("key", limit)) == 0
+
+
+def test_backend_storage_shared(monkeypatch):
+    now = 1200.0
+    monkeypatch.setattr("app.ratelimit.time.time", lambda: now)
+    backend = MemoryBackend()
+    worker_1, worker_2 = BackendStorage(backend), BackendStorage(backend)
+    limit = Limit(3, 60)
+    assert asyncio.run(worker_1.take("key", limit)) == 0
+    assert asyncio.run(worker_2.take("key", limit)) == 0
+    assert asyncio.run(worker_1.take("key", limit)) == 0
+    assert asyncio.run(worker_2.take("key", limit)) == 20
+    assert asyncio.run(worker_2.take("other key", limit)) == 0
+    # A token every 20 seconds, the refused requests take none
+    now += 30
+    assert asyncio.run(worker_1.take("key", limit)) == 0
+    assert asyncio.run(worker_2.take("key", limit)) == 10
+    now += 10
+    assert asyncio.run(worker_2.take("key", limit)) == 0
+
+
+def test_backend_storage_retries_a_lost_race(monkeypatch):
+    backend = MemoryBackend()
+    storage = BackendStorage(backend)
+    limit = Limit(2, 60)
+    compare_and_set = backend.compare_and_set
+
+    async def racing_compare_and_set(key, expected, value, ttl):
+        # Another worker takes a token between the read and the write, once
+        monkeypatch.setattr(backend, "compare_and_set", compare_and_set)
+        await storage.take(key.removeprefix("ratelimit:"), limit)
+        return await compare_and_set(key, expected, value, ttl)
+
+    monkeypatch.setattr(backend, "compare_and_set", racing_compare_and_set)
+    assert asyncio.run(storage.take("key", limit)) == 0
+    assert asyncio.run(storage.take("key", limit)) > 0
+
+
+def test_login_rate_limited_by_ip(monkeypatch, client, test_user):
+    monkeypatch.setitem(ratelimit.RULES, ("POST", "/login"), ("auth", Limit(2, 60)))
+    credentials = {"username": test_user["email"], "password": test_user["password"]}
+    assert client.post("/login", data=credentials).status_code == 200
+    assert client.post("/login", data={**credentials, "password": "wrong"}).status_code == 403
+    response = client.post("/login", data=credentials)
+    assert response.status_code == 429
+    assert 0 < int(response.headers["retry-after"]) <= 30
+
+
+def test_writes_rate_limited_by_user(monkeypatch, client, test_users):
+    monkeypatch.setitem(ratelimit.RULES, ("POST", "/posts"), ("writes", Limit(1, 60)))
+    post = {"title": "title", "content": "content"}
+    tokens = [
+        client.post("/login", data={"username": user["email"], "password": user["password"]}).json()["access_token"]
+        for user in test_users
+    ]
+    headers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+    assert client.post("/posts/", json=post, headers=headers[0]).status_code == 201
+    assert client.post("/posts/", json=post, headers=headers[0]).status_code == 429
+    # Same IP, other user
+    assert client.post("/posts/", json=post, headers=headers[1]).status_code == 201
+
+
+def test_load_shedding(monkeypatch, authorized_client, test_posts):
+    monkeypatch.setattr(settings, "shed_pool_wait_ms", 100)
+    monkeypatch.setattr(database.recent_pool_wait, "value", lambda: 0.5)
+    response = authorized_client.post("/posts/", json={"title": "title", "content": "content"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(settings.shed_retry_after)
+    # The reads are still served
+    assert authorized_client.get("/posts/").status_code == 200
+
+    monkeypatch.setattr(database.recent_pool_wait, "value", lambda: 0.01)
+    assert authorized_client.post("/posts/", json={"title": "title", "content": "content"}).status_code == 201
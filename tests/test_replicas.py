@@ -0,0 +1,112 @@
+import asyncio
+import itertools
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app import models
+from app.config import settings
+from app.database import Base
+from app.oauth2 import create_access_token
+from app.replicas import Replica, replica_set
+from .conftest import SQLALCHEMY_DATABASE_URL, engine
+
+# A second local database stands in for the replica, filled by the tests instead of replication
+REPLICA_URL = SQLALCHEMY_DATABASE_URL.replace("/fastapi_test", "/fastapi_test_replica")
+
+
+def routes_engine(url):
+    # Without a pool, as the asyncpg connections can't be shared by the event loops of the TestClient
+    if settings.async_database:
+        return create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://"), poolclass=NullPool)
+    return create_engine(url, poolclass=NullPool)
+
+
+@pytest.fixture
+def replica(session, monkeypatch):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if not connection.scalar(text("SELECT 1 FROM pg_database WHERE datname = 'fastapi_test_replica'")):
+            connection.execute(text("CREATE DATABASE fastapi_test_replica"))
+    replica_engine = create_engine(REPLICA_URL, poolclass=NullPool)
+    Base.metadata.drop_all(bind=replica_engine)
+    Base.metadata.create_all(bind=replica_engine)
+    monkeypatch.setattr(replica_set, "replicas", [Replica(REPLICA_URL, "replica0", routes_engine(REPLICA_URL))])
+    replica_set._sticky_users.clear()
+    yield replica_engine
+    replica_set._sticky_users.clear()
+    replica_engine.dispose()
+
+
+def replicate_users(session, replica_engine):
+    users = session.execute(select(models.User.__table__)).mappings().all()
+    with replica_engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [dict(user) for user in users])
+
+
+def titles(response):
+    assert response.status_code == 200
+    return sorted(post["title"] for post in response.json())
+
+
+def test_reads_go_to_the_replica(authorized_client, test_posts, session, replica):
+    replicate_users(session, replica)
+    with replica.begin() as connection:
+        connection.execute(
+            models.Post.__table__.insert(),
+            {"title": "replica title", "content": "replica content", "user_id": test_posts[0].user_id},
+        )
+    assert titles(authorized_client.get("/posts/")) == ["replica title"]
+    assert authorized_client.get(f"/users/{test_posts[0].user_id}").status_code == 200
+
+
+def test_replica_responses_not_cached(authorized_client, test_posts, session, replica):
+    replicate_users(session, replica)
+    post = {"title": "replica title", "content": "replica content", "user_id": test_posts[0].user_id}
+    with replica.begin() as connection:
+        connection.execute(models.Post.__table__.insert(), post)
+    response = authorized_client.get("/posts/")
+    assert titles(response) == ["replica title"]
+    assert "etag" in response.headers
+    # Had the page been cached, the next write replayed by the replica wouldn't show
+    with replica.begin() as connection:
+        connection.execute(models.Post.__table__.insert(), {**post, "title": "replayed title"})
+    assert titles(authorized_client.get("/posts/")) == ["replayed title", "replica title"]
+
+
+def test_writers_read_their_writes(authorized_client, test_users, session, replica):
+    replicate_users(session, replica)
+    response = authorized_client.post("/posts/", json={"title": "new title", "content": "new content"})
+    assert response.status_code == 201
+    # The writer reads from the primary, the other users from the replica which didn't replay the post.
+    # Each reads another page, as the primary's responses are cached for everyone
+    assert titles(authorized_client.get("/posts/?limit=5")) == ["new title"]
+    other_token = create_access_token({"user_id": test_users[1]["id"]})
+    response = authorized_client.get("/posts/?limit=6", headers={"Authorization": f"Bearer {other_token}"})
+    assert titles(response) == []
+    # Once the stickiness expired, the writer is back on the replica
+    replica_set._sticky_users.clear()
+    assert titles(authorized_client.get("/posts/?limit=7")) == []
+
+
+def test_unhealthy_replica_falls_back(authorized_client, test_posts, session, replica, monkeypatch):
+    replicate_users(session, replica)
+    missing_url = SQLALCHEMY_DATABASE_URL.replace("/fastapi_test", "/fastapi_test_missing")
+    monkeypatch.setattr(replica_set, "replicas", [Replica(missing_url, "replica1", routes_engine(missing_url))])
+    asyncio.run(replica_set.check())
+    assert not replica_set.replicas[0].healthy
+    assert titles(authorized_client.get("/posts/")) == sorted(post.title for post in test_posts)
+
+    monkeypatch.setattr(replica_set, "replicas", [Replica(REPLICA_URL, "replica0", routes_engine(REPLICA_URL))])
+    asyncio.run(replica_set.check())
+    assert replica_set.replicas[0].healthy
+
+
+def test_round_robin(monkeypatch):
+    monkeypatch.setattr(replica_set, "replicas", [Replica("", name) for name in "abc"])
+    monkeypatch.setattr(replica_set, "_turn", itertools.count())
+    replica_set.replicas[1].healthy = False
+    assert [replica_set.choose().name for _ in range(4)] == ["a", "c", "a", "c"]
+    replica_set.replicas[0].healthy = replica_set.replicas[2].healthy = False
+    assert replica_set.choose() is None
@@ -0,0 +1,66 @@
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from app.schemas import PostWithVotes
+from app.search import search_posts
+
+
+@pytest.fixture
+def sqlite_session():
+    # Stands in for Postgres, search runs on the FTS5 table there
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = models.User(email="search@test.com", password="password")
+    db.add(user)
+    db.commit()
+    db.add_all(
+        [
+            models.Post(title="pizza", content="margherita pizza pizza", published=True, user_id=user.id),
+            models.Post(title="fastapi", content="a web framework", published=True, user_id=user.id),
+            models.Post(title="favourite pizza", content="calzone", published=True, user_id=user.id),
+        ]
+    )
+    db.commit()
+    try:
+        yield db
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def test_search_sqlite(sqlite_session):
+    query = search_posts("sqlite", select(models.Post), "pizza")
+    assert [post.title for post in sqlite_session.scalars(query)] == ["pizza", "favourite pizza"]
+
+
+def test_search_sqlite_follows_updates(sqlite_session):
+    post = sqlite_session.query(models.Post).filter(models.Post.title == "fastapi").one()
+    post.content = "pizza framework"
+    sqlite_session.commit()
+    query = search_posts("sqlite", select(models.Post), "framework pizza")
+    assert [post.title for post in sqlite_session.scalars(query)] == ["fastapi"]
+
+
+def test_search_sqlite_empty(sqlite_session):
+    query = search_posts("sqlite", select(models.Post), "")
+    assert len(sqlite_session.scalars(query).all()) == 3
+
+
+@pytest.mark.parametrize(
+    "search, titles",
+    [
+        ("1st", ["1st title"]),
+        ("extra content", ["extra user title"]),
+        ("titles", ["1st title", "2nd title", "3rd title", "extra user title"]),
+        ("nothing", []),
+    ],
+)
+def test_search_posts(authorized_client, test_posts, search, titles):
+    response = authorized_client.get("/posts", params={"search": search})
+    assert response.status_code == 200
+    posts = [PostWithVotes(**post) for post in response.json()]
+    assert sorted(post.title for post in posts) == titles
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from app import database, oauth2
+from app.config import Settings, get_settings, settings
+from app.database import ThreadedSession, alembic_head
+from app.main import app
+
+
+@pytest.fixture
+def alembic_version(session):
+    """Stamp the test database, whose tables come from the models, at the given revision"""
+    def stamp(revision):
+        session.execute(text("CREATE TABLE IF NOT EXISTS alembic_version (version_num VARCHAR(32) PRIMARY KEY)"))
+        session.execute(text("DELETE FROM alembic_version"))
+        session.execute(text("INSERT INTO alembic_version VALUES (:revision)"), {"revision": revision})
+        session.commit()
+
+    yield stamp
+    session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+    session.commit()
+
+
+def test_check_revision(session, alembic_version):
+    with pytest.raises(RuntimeError):
+        asyncio.run(database.check_revision(ThreadedSession(session)))
+    alembic_version("93aced77ecf0")
+    with pytest.raises(RuntimeError, match="alembic upgrade head"):
+        asyncio.run(database.check_revision(ThreadedSession(session)))
+    alembic_version(alembic_head())
+    asyncio.run(database.check_revision(ThreadedSession(session)))
+
+
+def test_lifespan(session, alembic_version):
+    with pytest.raises(RuntimeError):
+        with TestClient(app):
+            pass
+    alembic_version(alembic_head())
+    with TestClient(app) as client:
+        assert client.get("/").status_code == 200
+        assert oauth2.revocation_list._task is not None
+    assert oauth2.revocation_list._task is None
+
+
+def test_import_without_database():
+    # Nothing connects before the first request
+    env = {**os.environ, "DATABASE_HOSTNAME": "unreachable.invalid"}
+    code = "import app.main, app.database as db; assert db._engine is None and db._async_engine is None"
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def test_settings_resolved_lazily(monkeypatch):
+    # Importing the config reads nothing, even without the required settings
+    env = {key: value for key, value in os.environ.items() if not key.startswith("DATABASE_")}
+    code = "import app.config as c; assert c.get_settings.cache_info().currsize == 0"
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+    assert get_settings() is get_settings()
+    monkeypatch.setattr(settings, "server_timing", False)
+    assert get_settings().server_timing is False
+
+
+def test_pgbouncer_needs_the_sync_driver():
+    assert Settings(database_pgbouncer=True, async_database=False).database_pgbouncer
+    with pytest.raises(ValidationError, match="only works with the sync driver"):
+        Settings(database_pgbouncer=True, async_database=True)
@@ -1,6 +1,7 @@
 from jose import jwt
-from app import schemas
+from app import models, schemas
 from app.config import settings
+from app.utils import pwd_context
 
 
 def test_create_user(client):
@@ -39,3 +40,19 @@ def test_login_incorrect(client, test_user):
         )
         assert response.status_code == 403
         assert response.json().get("detail") == "Invalid credentials"
+
+
+def test_login_rehashes_password(client, session, test_user):
+    user = session.get(models.User, test_user["id"])
+    user.password = pwd_context.handler("bcrypt").using(rounds=4).hash(test_user["password"])
+    session.commit()
+    response = client.post(
+        "/login",
+        data={"username": test_user["email"], "password": test_user["password"]},
+    )
+    assert response.status_code == 200
+    session.expire_all()  # The login updated the user through another session
+    user = session.get(models.User, test_user["id"])
+    assert pwd_context.identify(user.password) == "bcrypt"
+    assert not pwd_context.needs_update(user.password)
+    assert pwd_context.verify(test_user["password"], user.password)
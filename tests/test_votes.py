@@ -1,5 +1,8 @@
 import pytest
 
+from app import models
+from app.commands import reconcile_votes
+
 
 def get_post_votes(user_client, post_id):
     return user_client.get(f"/posts/{post_id}").json()["votes"]
@@ -91,6 +94,57 @@ def test_vote_non_existing_post(authorized_client, dir):
     assert response.json().get("detail") == f"Post with id {fake_post_id} was not found"
 
 
+def test_vote_deleted_post(authorized_client, test_users, test_posts):
+    post_id = test_posts[0].id  # Of the authorized user
+    assert authorized_client.post("/votes", json={"post_id": post_id, "dir": 1}).status_code == 201
+    assert authorized_client.delete(f"/posts/{post_id}").status_code == 204
+    # Even though the vote is still there until the purge
+    for dir in (1, 0):
+        response = authorized_client.post("/votes", json={"post_id": post_id, "dir": dir})
+        assert response.status_code == 404
+
+
+def test_reconcile_votes(authorized_client, session, test_users, test_posts):
+    second_user_post_id = get_second_user_post_id(test_users, test_posts)
+    first_post_id = test_posts[0].id
+    authorized_client.post("/votes", json={"post_id": second_user_post_id, "dir": 1})
+    session.query(models.Post).update({models.Post.vote_count: 5})
+    session.commit()
+    assert reconcile_votes(session, batch_size=3) == len(test_posts)
+    assert get_post_votes(authorized_client, second_user_post_id) == 1
+    assert get_post_votes(authorized_client, first_post_id) == 0
+    assert reconcile_votes(session) == 0
+
+
+def test_vote_batch(authorized_client, test_users, test_posts):
+    second_user_post_id = get_second_user_post_id(test_users, test_posts)
+    first_post_id, second_post_id = test_posts[0].id, test_posts[1].id
+    authorized_client.post("/votes", json={"post_id": first_post_id, "dir": 1})
+    data = [
+        {"post_id": second_user_post_id, "dir": 1},
+        {"post_id": first_post_id, "dir": 0},
+        {"post_id": second_post_id, "dir": 0},
+        {"post_id": 666, "dir": 1},
+    ]
+    response = authorized_client.post("/votes/batch", json=data)
+    assert response.status_code == 200
+    assert [result["status_code"] for result in response.json()] == [201, 201, 409, 404]
+    assert get_post_votes(authorized_client, second_user_post_id) == 1
+    assert get_post_votes(authorized_client, first_post_id) == 0
+
+    response = authorized_client.post("/votes/batch", json=data[:1])
+    assert response.json()[0]["detail"] == (
+        f"User {test_users[0]['id']} has already upvoted post {second_user_post_id}"
+    )
+    assert get_post_votes(authorized_client, second_user_post_id) == 1
+
+
+def test_vote_batch_duplicate_post(authorized_client, test_posts):
+    data = [{"post_id": test_posts[0].id, "dir": 1}, {"post_id": test_posts[0].id, "dir": 0}]
+    response = authorized_client.post("/votes/batch", json=data)
+    assert response.status_code == 422
+
+
 # Some adjustments need to be made to the pydantic validation of Vote
 # @pytest.mark.parametrize("dir", [2, "a", True, False])
 # def test_vote_non_accepted_dir(authorized_client, test_posts, dir):